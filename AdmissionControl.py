@@ -0,0 +1,200 @@
+import functools
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import Dict
+import Solution
+from Utility.ReturnValue import ReturnValue
+from Business.Query import Query
+from Business.RAM import RAM
+from Business.Disk import Disk
+
+# Admission control in front of the Solution functions. AdmissionController(...).install() wraps them so that
+# reads and writes each run with their own concurrency limit and bounded wait queue. A call that finds its queue
+# full, or does not get a slot before its deadline, is rejected at once with the value the function returns on
+# a database error, instead of opening one more connection.
+
+WRITE_FUNCTIONS = ["addQuery", "deleteQuery", "addDisk", "deleteDisk", "addRAM", "deleteRAM", "addDiskAndQuery",
+                   "addQueryToDisk", "removeQueryFromDisk", "addRAMToDisk", "removeRAMFromDisk",
+                   "enqueueUnplacedQueries", "claimUnplacedQueries", "releaseQueries", "completeQueries"]
+
+READ_FUNCTIONS = ["getQueryProfile", "getQueryProfiles", "getDiskProfile", "getDiskProfiles", "getRAMProfile",
+                  "getRAMProfiles", "averageSizeQueriesOnDisk", "diskTotalRAM", "getCostForPurpose",
+                  "getQueriesCanBeAddedToDisk", "getQueriesCanBeAddedToDiskAndRAM", "isCompanyExclusive",
+                  "getCompanyExclusivity", "getConflictingDisks", "getConflictingDisksChanges", "mostAvailableDisks",
+                  "getCloseQueries", "getDiskDashboard"]
+
+# what every function returns when it is rejected, the same as on a database error:
+REJECTED = {
+    "getQueryProfile": lambda queryID: Query.badQuery(),
+    "getQueryProfiles": lambda queryIDs: {queryID: Query.badQuery() for queryID in queryIDs},
+    "getDiskProfile": lambda diskID: Disk.badDisk(),
+    "getDiskProfiles": lambda diskIDs: {diskID: Disk.badDisk() for diskID in diskIDs},
+    "getRAMProfile": lambda ramID: RAM.badRAM(),
+    "getRAMProfiles": lambda ramIDs: {ramID: RAM.badRAM() for ramID in ramIDs},
+    "averageSizeQueriesOnDisk": lambda diskID: -1,
+    "diskTotalRAM": lambda diskID: -1,
+    "getCostForPurpose": lambda purpose: -1,
+    "getQueriesCanBeAddedToDisk": lambda diskID: [],
+    "getQueriesCanBeAddedToDiskAndRAM": lambda diskID: [],
+    "isCompanyExclusive": lambda diskID: False,
+    "getCompanyExclusivity": lambda diskIDs=None: {} if diskIDs is None else
+    {diskID: (False, []) for diskID in diskIDs},
+    "getConflictingDisks": lambda: [],
+    "getConflictingDisksChanges": lambda sinceVersion: (sinceVersion, [], []),
+    "mostAvailableDisks": lambda: [],
+    "getCloseQueries": lambda queryID: [],
+    "getDiskDashboard": lambda diskIDs=None: iter([]),
+    "claimUnplacedQueries": lambda worker, batchSize, visibilityTimeout: [],
+}
+
+
+class Lane:
+    def __init__(self, limit: int, maxQueue: int, timeout: float):
+        self.limit = limit
+        self.maxQueue = maxQueue
+        self.timeout = timeout
+        self.__condition = threading.Condition()
+        self.__running = 0
+        self.__waiting = 0
+        self.__admitted = 0
+        self.__rejected = 0
+        self.__maxQueueDepth = 0
+        self.__totalWait = 0.0
+        self.__maxWait = 0.0
+
+    # waits at most timeout seconds for a slot, returns whether the call was admitted. A call whose deadline has
+    # passed is rejected even if a slot is free
+    def acquire(self, timeout: float) -> bool:
+        start = time.monotonic()
+        with self.__condition:
+            if timeout <= 0:
+                self.__rejected += 1
+                return False
+            if self.__running >= self.limit or self.__waiting > 0:
+                if self.__waiting >= self.maxQueue:
+                    self.__rejected += 1
+                    return False
+                self.__waiting += 1
+                self.__maxQueueDepth = max(self.__maxQueueDepth, self.__waiting)
+                try:
+                    while self.__running >= self.limit:
+                        remaining = start + timeout - time.monotonic()
+                        if remaining <= 0:
+                            self.__rejected += 1
+                            return False
+                        self.__condition.wait(remaining)
+                finally:
+                    self.__waiting -= 1
+            self.__running += 1
+            self.__admitted += 1
+            wait = time.monotonic() - start
+            self.__totalWait += wait
+            self.__maxWait = max(self.__maxWait, wait)
+            return True
+
+    def release(self):
+        with self.__condition:
+            self.__running -= 1
+            self.__condition.notify()
+
+    def metrics(self) -> Dict[str, float]:
+        with self.__condition:
+            return {"running": self.__running, "queueDepth": self.__waiting, "maxQueueDepth": self.__maxQueueDepth,
+                    "admitted": self.__admitted, "rejected": self.__rejected,
+                    "averageWait": self.__totalWait / self.__admitted if self.__admitted else 0.0,
+                    "maxWait": self.__maxWait}
+
+
+# iterates over a generator while holding its lane slot, which is released once the generator is exhausted,
+# fails, is closed or is garbage collected, whether or not it was ever started
+class SlotHoldingIterator:
+    def __init__(self, generator, lane: Lane):
+        self.__generator = generator
+        self.__lane = lane
+        self.__lock = threading.Lock()
+        self.__released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.__generator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self.__lock:
+            if self.__released:
+                return
+            self.__released = True
+        try:
+            self.__generator.close()
+        finally:
+            self.__lane.release()
+
+    def __del__(self):
+        self.close()
+
+
+class AdmissionController:
+    def __init__(self, readLimit: int = 20, writeLimit: int = 10, readQueue: int = 100, writeQueue: int = 100,
+                 readTimeout: float = 1.0, writeTimeout: float = 5.0):
+        self.reads = Lane(readLimit, readQueue, readTimeout)
+        self.writes = Lane(writeLimit, writeQueue, writeTimeout)
+        self.__deadlines = threading.local()
+        self.__originals = {}
+
+    def install(self):
+        for names, lane in [(READ_FUNCTIONS, self.reads), (WRITE_FUNCTIONS, self.writes)]:
+            for name in names:
+                self.__originals[name] = getattr(Solution, name)
+                setattr(Solution, name, self.__wrap(name, self.__originals[name], lane))
+
+    def uninstall(self):
+        for name, function in self.__originals.items():
+            setattr(Solution, name, function)
+        self.__originals = {}
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+
+    # the calls this thread makes inside the block are rejected if they cannot start within seconds
+    @contextmanager
+    def deadline(self, seconds: float):
+        previous = getattr(self.__deadlines, "deadline", None)
+        self.__deadlines.deadline = time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            self.__deadlines.deadline = previous
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        return {"reads": self.reads.metrics(), "writes": self.writes.metrics()}
+
+    def __wrap(self, name, function, lane: Lane):
+        @functools.wraps(function)
+        def admitted(*args, **kwargs):
+            deadline = getattr(self.__deadlines, "deadline", None)
+            timeout = lane.timeout if deadline is None else deadline - time.monotonic()
+            if not lane.acquire(timeout):
+                return REJECTED[name](*args, **kwargs) if name in REJECTED else ReturnValue.ERROR
+            release = True
+            try:
+                result = function(*args, **kwargs)
+                # a generator does its work while it is consumed, so it holds the slot until then:
+                if isinstance(result, types.GeneratorType):
+                    release = False
+                    return SlotHoldingIterator(result, lane)
+                return result
+            finally:
+                if release:
+                    lane.release()
+        return admitted
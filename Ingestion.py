@@ -0,0 +1,346 @@
+import argparse
+import csv
+import io
+import json
+import os
+from multiprocessing import Pool
+from typing import List, Dict, Tuple
+import Utility.DBConnector as Connector
+from psycopg2 import sql
+from Solution import createTransaction, conflictsIncrement
+
+# Parallel bulk ingestion of inventory feeds (CSV with a header line or JSONL, one record per line).
+# Workers validate their chunk with the same rules as the CHECK constraints of createTables and COPY the
+# valid rows into staging tables, then the staged rows are merged into the real tables in one transaction.
+# Usage: python Ingestion.py --disks disks.csv --queries queries.jsonl --query-placements qd.csv --workers 4
+
+CHUNK_SIZE = 50000
+
+# range of the INTEGER columns, a value outside it would fail the COPY of its whole chunk:
+INTEGER_MIN = -2147483648
+INTEGER_MAX = 2147483647
+
+# kind -> (staging table, target table, key columns, [(column, type, nullable, minimum)])
+KINDS = {
+    "queries": ("StagingQueries", "Queries", ["queryID"],
+                [("queryID", int, False, 1), ("purpose", str, False, None), ("querySize", int, False, 0)]),
+    "disks": ("StagingDisks", "Disks", ["diskID"],
+              [("diskID", int, False, 1), ("diskCompany", str, False, None), ("speed", int, False, 1),
+               ("freeSpace", int, False, 0), ("costPerByte", int, False, 1)]),
+    "rams": ("StagingRAMs", "RAMs", ["ramID"],
+             [("ramID", int, False, 1), ("ramSize", int, False, 1), ("ramCompany", str, False, None)]),
+    "query-placements": ("StagingQueryOnDisk", "QueryOnDisk", ["queryID", "diskID"],
+                         [("queryID", int, False, None), ("diskID", int, False, None)]),
+    "ram-placements": ("StagingRAMOnDisk", "RAMOnDisk", ["ramID", "diskID"],
+                       [("ramID", int, False, None), ("diskID", int, False, None)]),
+}
+
+# staged string column -> (dictionary table, code column, value column, target column holding the code)
+ENCODED_COLUMNS = {
+    "purpose": ("Purposes", "purposeID", "purpose", "purposeID"),
+    "diskCompany": ("Companies", "companyID", "company", "diskCompanyID"),
+    "ramCompany": ("Companies", "companyID", "company", "ramCompanyID"),
+}
+
+# entities before the placements that reference them:
+MERGE_ORDER = ["queries", "disks", "rams", "query-placements", "ram-placements"]
+
+DUPLICATE_IN_INPUT = "duplicate in input"
+ALREADY_EXISTS = "already exists"
+NOT_EXISTS = "query, disk or RAM does not exist"
+NO_FREE_SPACE = "not enough free space on disk"
+
+
+# ingests the given {kind: path} files and writes the rejected records to rejectsFile
+# returns {kind: (accepted, rejected)}
+def ingest(files: Dict[str, str], rejectsFile: str, workers: int = os.cpu_count()) -> Dict[str, Tuple[int, int]]:
+    rejects = []
+    createStagingTables()
+    try:
+        with Pool(workers) as pool:
+            tasks = ((kind, chunk) for kind, path in files.items() for chunk in readChunks(path))
+            for kind, chunkRejects in pool.imap_unordered(stageChunk, tasks):
+                rejects += [(kind, lineNo, reason) for lineNo, reason in chunkRejects]
+        rejects += mergeStagingTables()
+        accepted = acceptedCounts()
+    finally:
+        dropStagingTables()
+
+    with open(rejectsFile, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "line", "reason"])
+        writer.writerows(sorted((files[kind], lineNo, reason) for kind, lineNo, reason in rejects))
+    return {kind: (accepted[kind], len([reject for reject in rejects if reject[0] == kind])) for kind in files}
+
+
+# yields lists of at most CHUNK_SIZE (lineNo, record)
+def readChunks(path: str):
+    chunk = []
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            records = ((lineNo, line) for lineNo, line in enumerate(f, 1) if line.strip())
+        else:
+            reader = csv.DictReader(f)
+            records = ((reader.line_num, record) for record in reader)
+        for lineNo, record in records:
+            chunk.append((lineNo, record))
+            if len(chunk) == CHUNK_SIZE:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+# runs in a worker process: validates the chunk and COPYs its valid rows into the staging table
+def stageChunk(task) -> Tuple[str, List[Tuple[int, str]]]:
+    kind, chunk = task
+    stagingTable, _, _, columns = KINDS[kind]
+    rejects = []
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for lineNo, record in chunk:
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            writer.writerow([lineNo] + validateRecord(record, columns))
+        except ValueError as e:
+            rejects.append((lineNo, str(e)))
+    buffer.seek(0)
+
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        sqlCopy = sql.SQL("COPY {table}(lineNo, {columns}) FROM STDIN WITH (FORMAT csv)") \
+            .format(table=sql.Identifier(stagingTable.lower()),
+                    columns=sql.SQL(", ").join(sql.Identifier(column.lower()) for column, _, _, _ in columns))
+        conn.copy(sqlCopy, buffer)
+        conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+    return kind, rejects
+
+
+def validateRecord(record, columns) -> list:
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+    row = []
+    for column, columnType, nullable, minimum in columns:
+        value = record.get(column)
+        if value is None or (columnType is int and value == ""):
+            if not nullable:
+                raise ValueError(column + " is missing")
+            row.append(None)
+            continue
+        if columnType is int:
+            if isinstance(value, bool) or isinstance(value, float):
+                raise ValueError(column + " is not an integer")
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(column + " is not an integer")
+            if minimum is not None and value < minimum:
+                raise ValueError(column + " must be at least " + str(minimum))
+            if value < INTEGER_MIN or value > INTEGER_MAX:
+                raise ValueError(column + " is out of integer range")
+        elif not isinstance(value, str):
+            raise ValueError(column + " is not a string")
+        row.append(value)
+    return row
+
+
+def createStagingTables():
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        statements = []
+        for kind in MERGE_ORDER:
+            stagingTable, _, _, columns = KINDS[kind]
+            columnsSql = [sql.SQL("{column} {type}").format(column=sql.Identifier(column.lower()),
+                                                            type=sql.SQL("INTEGER" if columnType is int else "TEXT"))
+                          for column, columnType, _, _ in columns]
+            statements.append(sql.SQL("DROP TABLE IF EXISTS {table}").format(table=sql.Identifier(stagingTable.lower())))
+            statements.append(sql.SQL("CREATE UNLOGGED TABLE {table}(lineNo INTEGER PRIMARY KEY, {columns}, "
+                                      "reason TEXT)")
+                              .format(table=sql.Identifier(stagingTable.lower()), columns=sql.SQL(", ").join(columnsSql)))
+        conn.execute(createTransaction(statements))
+        conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def dropStagingTables():
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        statements = [sql.SQL("DROP TABLE IF EXISTS {table}").format(table=sql.Identifier(KINDS[kind][0].lower()))
+                      for kind in MERGE_ORDER]
+        conn.execute(createTransaction(statements))
+        conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+# merges every staging table into its target table in one transaction
+# returns the (kind, lineNo, reason) of the staged rows rejected by the merge
+def mergeStagingTables() -> List[Tuple[str, int, str]]:
+    conn = None
+    rejects = []
+    try:
+        conn = Connector.DBConnector()
+        statements = []
+        for kind in MERGE_ORDER:
+            statements += rejectDuplicates(kind) + rejectExisting(kind)
+            if kind == "query-placements":
+                statements += rejectMissing(kind, ["Queries", "queryID"], ["Disks", "diskID"]) + rejectNoFreeSpace()
+            elif kind == "ram-placements":
+                statements += rejectMissing(kind, ["RAMs", "ramID"], ["Disks", "diskID"])
+            statements += insertAccepted(kind)
+            if kind == "query-placements":
+                statements += placeAccepted()
+        conn.execute(createTransaction(statements))
+        conn.commit()
+
+        for kind in MERGE_ORDER:
+            sqlQuery = sql.SQL("SELECT lineNo, reason FROM {table} WHERE reason IS NOT NULL") \
+                .format(table=sql.Identifier(KINDS[kind][0].lower()))
+            rows_affected, result = conn.execute(sqlQuery)
+            rejects += [(kind, result[i]['lineNo'], result[i]['reason']) for i in range(result.size())]
+        conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+    return rejects
+
+
+def acceptedCounts() -> Dict[str, int]:
+    conn = None
+    accepted = {}
+    try:
+        conn = Connector.DBConnector()
+        for kind in MERGE_ORDER:
+            sqlQuery = sql.SQL("SELECT COUNT(*) FROM {table} WHERE reason IS NULL") \
+                .format(table=sql.Identifier(KINDS[kind][0].lower()))
+            rows_affected, result = conn.execute(sqlQuery)
+            accepted[kind] = result[0]['count']
+        conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+    return accepted
+
+
+def stagingIdentifiers(kind):
+    stagingTable, targetTable, keys, columns = KINDS[kind]
+    return sql.Identifier(stagingTable.lower()), sql.Identifier(targetTable.lower()), \
+        [sql.Identifier(key.lower()) for key in keys], [sql.Identifier(column.lower()) for column, _, _, _ in columns]
+
+
+def rejectDuplicates(kind) -> List[sql.Composed]:
+    # only the first record of every key is kept:
+    staging, _, keys, _ = stagingIdentifiers(kind)
+    return [sql.SQL("UPDATE {staging} S SET reason = {reason} "
+                    "FROM (SELECT lineNo, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY lineNo) AS num "
+                    "FROM {staging}) D "
+                    "WHERE D.lineNo = S.lineNo AND D.num > 1")
+            .format(staging=staging, reason=sql.Literal(DUPLICATE_IN_INPUT), keys=sql.SQL(", ").join(keys))]
+
+
+def rejectExisting(kind) -> List[sql.Composed]:
+    staging, target, keys, _ = stagingIdentifiers(kind)
+    return [sql.SQL("UPDATE {staging} S SET reason = {reason} "
+                    "WHERE S.reason IS NULL AND EXISTS (SELECT 1 FROM {target} T WHERE {match})")
+            .format(staging=staging, target=target, reason=sql.Literal(ALREADY_EXISTS),
+                    match=sql.SQL(" AND ").join(sql.SQL("T.{key} = S.{key}").format(key=key) for key in keys))]
+
+
+def rejectMissing(kind, *references) -> List[sql.Composed]:
+    staging, _, _, _ = stagingIdentifiers(kind)
+    missing = [sql.SQL("NOT EXISTS (SELECT 1 FROM {table} T WHERE T.{key} = S.{key})")
+               .format(table=sql.Identifier(table.lower()), key=sql.Identifier(key.lower()))
+               for table, key in references]
+    return [sql.SQL("UPDATE {staging} S SET reason = {reason} WHERE S.reason IS NULL AND ({missing})")
+            .format(staging=staging, reason=sql.Literal(NOT_EXISTS), missing=sql.SQL(" OR ").join(missing))]
+
+
+def rejectNoFreeSpace() -> List[sql.Composed]:
+    # placements are accepted in input order until their disk is full:
+    return [sql.SQL("UPDATE StagingQueryOnDisk S SET reason = {reason} "
+                    "FROM (SELECT S2.lineNo, D.freeSpace, "
+                    "SUM(Q.querySize) OVER (PARTITION BY S2.diskID ORDER BY S2.lineNo) AS used "
+                    "FROM StagingQueryOnDisk S2, Queries Q, Disks D "
+                    "WHERE S2.reason IS NULL AND Q.queryID = S2.queryID AND D.diskID = S2.diskID) F "
+                    "WHERE F.lineNo = S.lineNo AND F.used > F.freeSpace")
+            .format(reason=sql.Literal(NO_FREE_SPACE))]
+
+
+# purposes and companies are stored as their dictionary codes, new strings are added to the dictionary first
+def insertAccepted(kind) -> List[sql.Composed]:
+    staging, target, _, _ = stagingIdentifiers(kind)
+    statements = []
+    targetColumns = []
+    values = []
+    joins = []
+    for column, _, _, _ in KINDS[kind][3]:
+        if column not in ENCODED_COLUMNS:
+            targetColumns.append(sql.Identifier(column.lower()))
+            values.append(sql.SQL("S.{column}").format(column=sql.Identifier(column.lower())))
+            continue
+        table, codeColumn, valueColumn, targetColumn = [sql.Identifier(name.lower())
+                                                        for name in ENCODED_COLUMNS[column]]
+        alias = sql.Identifier("dictionary" + str(len(joins)))
+        statements.append(sql.SQL("INSERT INTO {table}({valueColumn}) "
+                                  "SELECT DISTINCT {column} FROM {staging} WHERE reason IS NULL "
+                                  "ON CONFLICT({valueColumn}) DO NOTHING")
+                          .format(table=table, valueColumn=valueColumn, column=sql.Identifier(column.lower()),
+                                  staging=staging))
+        targetColumns.append(targetColumn)
+        values.append(sql.SQL("{alias}.{codeColumn}").format(alias=alias, codeColumn=codeColumn))
+        joins.append(sql.SQL("JOIN {table} {alias} ON {alias}.{valueColumn} = S.{column}")
+                     .format(table=table, alias=alias, valueColumn=valueColumn,
+                             column=sql.Identifier(column.lower())))
+    statements.append(sql.SQL("INSERT INTO {target}({targetColumns}) SELECT {values} FROM {staging} S {joins} "
+                              "WHERE S.reason IS NULL")
+                      .format(target=target, targetColumns=sql.SQL(", ").join(targetColumns),
+                              values=sql.SQL(", ").join(values), staging=staging, joins=sql.SQL(" ").join(joins)))
+    return statements
+
+
+def placeAccepted() -> List[sql.Composed]:
+    # the same bookkeeping addQueryToDisk does, for all the accepted placements at once:
+    sqlUpdateFreeSpace = sql.SQL("UPDATE Disks D SET freeSpace = D.freeSpace - U.used "
+                                 "FROM (SELECT S.diskID, SUM(Q.querySize) AS used FROM StagingQueryOnDisk S, Queries Q "
+                                 "WHERE S.reason IS NULL AND Q.queryID = S.queryID GROUP BY S.diskID) U "
+                                 "WHERE D.diskID = U.diskID")
+    sqlUpdateReplicas = sql.SQL("INSERT INTO QueryReplicas(queryID, disksNum) "
+                                "SELECT queryID, COUNT(*) FROM StagingQueryOnDisk WHERE reason IS NULL GROUP BY queryID "
+                                "ON CONFLICT(queryID) DO UPDATE SET disksNum = "
+                                "QueryReplicas.disksNum + EXCLUDED.disksNum")
+    # the new disks of a shared query gain it, and so does its old disk if it was on exactly one before:
+    sharedDisks = sql.SQL("SELECT QD.diskID FROM QueryOnDisk QD, QueryReplicas QR, "
+                          "(SELECT queryID, COUNT(*) AS added FROM StagingQueryOnDisk WHERE reason IS NULL "
+                          "GROUP BY queryID) A "
+                          "WHERE QD.queryID = A.queryID AND QR.queryID = A.queryID AND QR.disksNum >= 2 "
+                          "AND (QR.disksNum - A.added = 1 OR EXISTS (SELECT 1 FROM StagingQueryOnDisk S "
+                          "WHERE S.reason IS NULL AND S.queryID = QD.queryID AND S.diskID = QD.diskID))")
+    return [sqlUpdateFreeSpace, sqlUpdateReplicas] + conflictsIncrement(sharedDisks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingestion of disks, RAMs, queries and placements.")
+    for kind in MERGE_ORDER:
+        parser.add_argument("--" + kind, help="CSV or JSONL file of " + kind.replace("-", " "))
+    parser.add_argument("--rejects", default="rejects.csv", help="file the rejected records are written to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = vars(parser.parse_args())
+    files = {kind: args[kind.replace("-", "_")] for kind in MERGE_ORDER if args[kind.replace("-", "_")] is not None}
+
+    summary = ingest(files, args["rejects"], args["workers"])
+    for kind, (accepted, rejected) in summary.items():
+        print(kind + ": " + str(accepted) + " accepted, " + str(rejected) + " rejected")
+
+
+if __name__ == "__main__":
+    main()
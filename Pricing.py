@@ -0,0 +1,100 @@
+import bisect
+from typing import List, Tuple, Optional
+import numpy as np
+import Utility.DBConnector as Connector
+from Business.Query import Query
+from psycopg2 import sql
+
+
+# Vectorised pricing of placements over one bulk fetch of Disks and the TotalRAM view. A placement costs
+# costPerByte * querySize, so ordering disks by costPerByte orders them by price for every query, and the k
+# cheapest disks a query fits on are the k first of that order among the disks with room for it.
+# Queries are given as Query objects or as query IDs, whose sizes are then fetched in one statement.
+class PriceList:
+    def __init__(self, diskIDs, freeSpace, cost, totalRAM):
+        self.diskIDs = np.asarray(diskIDs, dtype=np.int64)
+        self.freeSpace = np.asarray(freeSpace, dtype=np.int64)
+        self.cost = np.asarray(cost, dtype=np.int64)
+        self.totalRAM = np.asarray(totalRAM, dtype=np.int64)
+        # disks from cheapest to most expensive, ties by diskID:
+        self.costOrder = np.lexsort((self.diskIDs, self.cost))
+
+    # all disks, or only the given ones
+    @staticmethod
+    def fromDatabase(diskIDs: Optional[List[int]] = None):
+        conn = None
+        try:
+            conn = Connector.DBConnector()
+            if diskIDs is None:
+                sqlFilter = sql.SQL("")
+            else:
+                sqlFilter = sql.SQL("AND D.diskID = ANY({diskIDs}::INTEGER[]) ").format(
+                    diskIDs=sql.Literal(list(diskIDs)))
+            sqlDisks = sql.SQL("SELECT D.diskID, D.freeSpace, D.costPerByte, TR.totalRAM "
+                               "FROM Disks D, TotalRAM TR WHERE TR.diskID = D.diskID {filter}"
+                               "ORDER BY D.diskID").format(filter=sqlFilter)
+            rows_affected, disks = conn.execute(sqlDisks)
+            conn.commit()
+        finally:
+            if conn is not None:
+                conn.close()
+
+        disks = np.array(disks.rows, dtype=np.int64).reshape(-1, 4)
+        return PriceList(disks[:, 0], disks[:, 1], disks[:, 2], disks[:, 3])
+
+    # costs[q, d] of placing the q-th query on the d-th disk of diskIDs
+    def costMatrix(self, queries) -> np.ndarray:
+        return querySizes(queries)[:, None] * self.cost[None, :]
+
+    # the IDs and costs of the k cheapest disks every query fits on (querySize <= freeSpace, and <= totalRAM when
+    # withRAM is set), one row per query, cheapest first. Rows of queries that fit on fewer disks end with -1
+    def cheapestDisks(self, queries, k: int, withRAM: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        sizes = querySizes(queries)
+        if len(self.diskIDs) == 0:
+            return np.full((len(sizes), k), -1, dtype=np.int64), np.full((len(sizes), k), -1, dtype=np.int64)
+        capacity = np.minimum(self.freeSpace, self.totalRAM) if withRAM else self.freeSpace
+        disksNum = len(self.diskIDs)
+        # a query fits on the disks of a prefix of the disks ordered by capacity, largest first. best[n] holds the
+        # k lowest cost ranks among the first n of them, disksNum where there are fewer than k:
+        costRank = np.empty(disksNum, dtype=np.int64)
+        costRank[self.costOrder] = np.arange(disksNum)
+        byCapacity = np.argsort(-capacity, kind="stable")
+        best = np.full((disksNum + 1, k), disksNum, dtype=np.int64)
+        lowest = [disksNum] * k
+        for n, rank in enumerate(costRank[byCapacity].tolist(), start=1):
+            if rank < lowest[-1]:
+                bisect.insort(lowest, rank)
+                lowest.pop()
+            best[n] = lowest
+        fitting = disksNum - np.searchsorted(np.sort(capacity), sizes, side="left")
+        ranks = best[fitting]
+
+        missing = ranks == disksNum
+        disks = self.costOrder[np.minimum(ranks, disksNum - 1)]
+        return np.where(missing, -1, self.diskIDs[disks]), np.where(missing, -1, sizes[:, None] * self.cost[disks])
+
+
+# sizes of the Query objects, or of the queries with the given IDs, in the order given
+def querySizes(queries) -> np.ndarray:
+    queries = list(queries)
+    if all(isinstance(query, Query) for query in queries):
+        return np.array([query.getSize() for query in queries], dtype=np.int64)
+    queryIDs = np.asarray(queries, dtype=np.int64)
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        sqlQuery = sql.SQL("SELECT queryID, querySize FROM Queries WHERE queryID = ANY({queryIDs}::INTEGER[]) "
+                           "ORDER BY queryID").format(queryIDs=sql.Literal(np.unique(queryIDs).tolist()))
+        rows_affected, result = conn.execute(sqlQuery)
+        conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    rows = np.array(result.rows, dtype=np.int64).reshape(-1, 2)
+    indices = np.searchsorted(rows[:, 0], queryIDs)
+    if (indices >= len(rows)).any() or (rows[np.minimum(indices, len(rows) - 1), 0] != queryIDs).any():
+        raise ValueError("query does not exist")
+    return rows[indices, 1]
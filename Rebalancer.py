@@ -0,0 +1,219 @@
+import argparse
+import bisect
+import heapq
+import statistics
+import time
+from typing import List, Dict, Tuple, NamedTuple
+import Utility.DBConnector as Connector
+from psycopg2 import sql
+from Solution import addQueryToDiskSql, removeQueryFromDiskSql
+
+# Online rebalancer: plans a set of query moves that even out the disks' free space ("balance") or lower the
+# total costPerByte*querySize of the placements ("cost"), and applies them in small batched transactions.
+# Every move is a removeQueryFromDisk of the query from its disk followed by an addQueryToDisk to the new one.
+# Usage: python Rebalancer.py --objective balance --max-moves 1000 --batch-size 50 --pause 0.2 [--dry-run]
+
+
+class Move(NamedTuple):
+    queryID: int
+    querySize: int
+    fromDisk: int
+    toDisk: int
+
+
+class FleetState:
+    def __init__(self, disks: Dict[int, Tuple[int, int]], placements: List[Tuple[int, int, int]]):
+        self.freeSpace = {diskID: freeSpace for diskID, (freeSpace, cost) in disks.items()}
+        self.cost = {diskID: cost for diskID, (freeSpace, cost) in disks.items()}
+        # (querySize, queryID) of the queries on every disk, sorted:
+        self.diskQueries = {diskID: [] for diskID in disks}
+        for queryID, diskID, querySize in placements:
+            self.diskQueries[diskID].append((querySize, queryID))
+        for queries in self.diskQueries.values():
+            queries.sort()
+        self.queryDisks = {}
+        for queryID, diskID, querySize in placements:
+            self.queryDisks.setdefault(queryID, set()).add(diskID)
+
+    @staticmethod
+    def fromDatabase():
+        conn = None
+        try:
+            conn = Connector.DBConnector()
+            # every SELECT must see the same snapshot, or placements could refer to disks or queries not read:
+            conn.execute(sql.SQL("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+            sqlDisks = sql.SQL("SELECT diskID, freeSpace, costPerByte FROM Disks")
+            sqlPlacements = sql.SQL("SELECT QD.queryID, QD.diskID, Q.querySize FROM QueryOnDisk QD, Queries Q "
+                                    "WHERE Q.queryID = QD.queryID")
+            rows_affected, disks = conn.execute(sqlDisks)
+            rows_affected, placements = conn.execute(sqlPlacements)
+            conn.commit()
+        finally:
+            if conn is not None:
+                conn.close()
+        return FleetState({row[0]: (row[1], row[2]) for row in disks.rows}, [tuple(row) for row in placements.rows])
+
+    def apply(self, move: Move):
+        self.diskQueries[move.fromDisk].remove((move.querySize, move.queryID))
+        bisect.insort(self.diskQueries[move.toDisk], (move.querySize, move.queryID))
+        self.queryDisks[move.queryID].remove(move.fromDisk)
+        self.queryDisks[move.queryID].add(move.toDisk)
+        self.freeSpace[move.fromDisk] += move.querySize
+        self.freeSpace[move.toDisk] -= move.querySize
+
+    def metrics(self) -> Dict[str, float]:
+        freeSpaces = list(self.freeSpace.values()) or [0]
+        totalCost = sum(self.cost[diskID] * querySize
+                        for diskID, queries in self.diskQueries.items() for querySize, _ in queries)
+        return {"minFreeSpace": min(freeSpaces), "maxFreeSpace": max(freeSpaces),
+                "freeSpaceStdDev": statistics.pstdev(freeSpaces), "totalCost": totalCost}
+
+
+# repeatedly moves the query from the fullest disk to the emptiest one that best halves their free space gap
+def planBalance(state: FleetState, maxMoves: int) -> List[Move]:
+    moves = []
+    fullest = [(freeSpace, diskID) for diskID, freeSpace in state.freeSpace.items()]
+    emptiest = [(-freeSpace, diskID) for diskID, freeSpace in state.freeSpace.items()]
+    heapq.heapify(fullest)
+    heapq.heapify(emptiest)
+    while len(moves) < maxMoves and fullest and emptiest:
+        # entries are pushed again on every change, so stale ones are skipped:
+        freeSpace, fromDisk = heapq.heappop(fullest)
+        if freeSpace != state.freeSpace[fromDisk]:
+            continue
+        while -emptiest[0][0] != state.freeSpace[emptiest[0][1]]:
+            heapq.heappop(emptiest)
+        toDisk = emptiest[0][1]
+        gap = state.freeSpace[toDisk] - state.freeSpace[fromDisk]
+        move = pickBalancingQuery(state, fromDisk, toDisk, gap)
+        # nothing on this disk can narrow the gap, it is dropped until a move onto it pushes it back:
+        if move is None:
+            continue
+        moves.append(move)
+        state.apply(move)
+        heapq.heappush(fullest, (state.freeSpace[fromDisk], fromDisk))
+        heapq.heappush(emptiest, (-state.freeSpace[toDisk], toDisk))
+        heapq.heappush(emptiest, (-state.freeSpace[fromDisk], fromDisk))
+        heapq.heappush(fullest, (state.freeSpace[toDisk], toDisk))
+    return moves
+
+
+# a query of size s narrows the gap only if 0 < s < gap, and closes it best at s = gap / 2
+def pickBalancingQuery(state: FleetState, fromDisk: int, toDisk: int, gap: int):
+    queries = state.diskQueries[fromDisk]
+    middle = bisect.bisect_left(queries, (gap // 2, 0))
+    candidates = sorted(range(len(queries)), key=lambda i: abs(i - middle))
+    for i in candidates:
+        querySize, queryID = queries[i]
+        if 0 < querySize < gap and toDisk not in state.queryDisks[queryID]:
+            return Move(queryID, querySize, fromDisk, toDisk)
+    return None
+
+
+# moves the most expensive placements to the cheapest disk they fit on
+def planCost(state: FleetState, maxMoves: int) -> List[Move]:
+    moves = []
+    disksByCost = sorted(state.cost, key=lambda diskID: state.cost[diskID])
+    placements = sorted(((querySize * state.cost[diskID], queryID, querySize, diskID)
+                         for diskID, queries in state.diskQueries.items() for querySize, queryID in queries),
+                        reverse=True)
+    for _, queryID, querySize, fromDisk in placements:
+        if len(moves) == maxMoves:
+            break
+        for toDisk in disksByCost:
+            if state.cost[toDisk] >= state.cost[fromDisk]:
+                break
+            if state.freeSpace[toDisk] >= querySize and toDisk not in state.queryDisks[queryID]:
+                move = Move(queryID, querySize, fromDisk, toDisk)
+                moves.append(move)
+                state.apply(move)
+                break
+    return moves
+
+
+# applies the moves in transactions of batchSize moves, sleeping pause seconds between them
+# a batch that fails is retried one move at a time, returns the number of (applied, skipped) moves
+def executeMoves(moves: List[Move], batchSize: int, pause: float) -> Tuple[int, int]:
+    applied = 0
+    skipped = 0
+    for start in range(0, len(moves), batchSize):
+        batch = moves[start:start + batchSize]
+        try:
+            done = executeBatch(batch)
+            applied += done
+            skipped += len(batch) - done
+        except Exception:
+            for move in batch:
+                try:
+                    done = executeBatch([move])
+                except Exception:
+                    done = 0
+                applied += done
+                skipped += 1 - done
+        time.sleep(pause)
+    return applied, skipped
+
+
+def executeBatch(batch: List[Move]) -> int:
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        # locks the placements to move and drops the ones that are gone since the plan was made:
+        sqlLock = sql.SQL("SELECT queryID, diskID FROM QueryOnDisk WHERE (queryID, diskID) IN ({pairs}) "
+                          "FOR UPDATE").format(pairs=sql.SQL(", ").join(
+                              sql.SQL("({queryID}, {diskID})").format(queryID=sql.Literal(move.queryID),
+                                                                      diskID=sql.Literal(move.fromDisk))
+                              for move in batch))
+        rows_affected, result = conn.execute(sqlLock)
+        # a later move of the batch may start from where an earlier one put the query:
+        placements = set(tuple(row) for row in result.rows)
+        statements = []
+        applied = 0
+        for move in batch:
+            if (move.queryID, move.fromDisk) in placements:
+                statements += removeQueryFromDiskSql(move.queryID, move.querySize, move.fromDisk)
+                statements += addQueryToDiskSql(move.queryID, move.querySize, move.toDisk)
+                placements.remove((move.queryID, move.fromDisk))
+                placements.add((move.queryID, move.toDisk))
+                applied += 1
+        if statements:
+            conn.execute(sql.SQL('; ').join(statements))
+        conn.commit()
+        return applied
+    except Exception:
+        if conn is not None:
+            conn.rollback()
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Moves queries off full or expensive disks.")
+    parser.add_argument("--objective", choices=["balance", "cost"], default="balance")
+    parser.add_argument("--max-moves", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=50, help="moves per transaction")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds to sleep between transactions")
+    parser.add_argument("--dry-run", action="store_true", help="only print the plan and its projected effect")
+    args = parser.parse_args()
+
+    state = FleetState.fromDatabase()
+    before = state.metrics()
+    plan = planBalance if args.objective == "balance" else planCost
+    moves = plan(state, args.max_moves)
+    after = state.metrics()
+
+    print(str(len(moves)) + " moves planned")
+    for metric in before:
+        print(metric + ": " + str(before[metric]) + " -> " + str(after[metric]))
+    if args.dry_run:
+        for move in moves:
+            print("query " + str(move.queryID) + ": disk " + str(move.fromDisk) + " -> disk " + str(move.toDisk))
+        return
+    applied, skipped = executeMoves(moves, args.batch_size, args.pause)
+    print(str(applied) + " moves applied, " + str(skipped) + " skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+from typing import List, Dict
+import numpy as np
+import Utility.DBConnector as Connector
+from psycopg2 import sql
+
+
+# What-if capacity simulator: a snapshot of Disks, Queries, QueryOnDisk and the TotalRAM view held in NumPy
+# arrays. Hypothetical additions, removals and placements are applied as vector operations, and the metrics
+# the Solution functions expose are recomputed from the arrays without touching the database.
+# Disks and queries are kept sorted by ID, new IDs are allocated above the current maximum.
+class CapacitySimulator:
+    def __init__(self, diskIDs, speed, freeSpace, cost, totalRAM, queryIDs, querySize, purposes: List[str],
+                 purposeCode, placedQueries, placedDisks):
+        self.diskIDs = np.asarray(diskIDs, dtype=np.int64)
+        self.speed = np.asarray(speed, dtype=np.int64)
+        self.freeSpace = np.asarray(freeSpace, dtype=np.int64)
+        self.cost = np.asarray(cost, dtype=np.int64)
+        self.totalRAM = np.asarray(totalRAM, dtype=np.int64)
+        self.queryIDs = np.asarray(queryIDs, dtype=np.int64)
+        self.querySize = np.asarray(querySize, dtype=np.int64)
+        self.purposes = list(purposes)
+        self.purposeCode = np.asarray(purposeCode, dtype=np.int64)
+        self.placedQueries = np.asarray(placedQueries, dtype=np.int64)
+        self.placedDisks = np.asarray(placedDisks, dtype=np.int64)
+
+    @staticmethod
+    def fromDatabase():
+        conn = None
+        try:
+            conn = Connector.DBConnector()
+            # every SELECT must see the same snapshot, or placements could refer to disks or queries not read:
+            conn.execute(sql.SQL("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+            sqlDisks = sql.SQL("SELECT D.diskID, D.speed, D.freeSpace, D.costPerByte, TR.totalRAM "
+                               "FROM Disks D, TotalRAM TR WHERE TR.diskID = D.diskID ORDER BY D.diskID")
+            sqlQueries = sql.SQL("SELECT Q.queryID, Q.querySize, P.purpose FROM Queries Q, Purposes P "
+                                 "WHERE P.purposeID = Q.purposeID ORDER BY Q.queryID")
+            sqlPlacements = sql.SQL("SELECT queryID, diskID FROM QueryOnDisk")
+            rows_affected, disks = conn.execute(sqlDisks)
+            rows_affected, queries = conn.execute(sqlQueries)
+            rows_affected, placements = conn.execute(sqlPlacements)
+            conn.commit()
+        finally:
+            if conn is not None:
+                conn.close()
+
+        disks = np.array(disks.rows, dtype=np.int64).reshape(-1, 5)
+        purposes, purposeCode = np.unique(np.array([row[2] for row in queries.rows], dtype=object).astype(str),
+                                          return_inverse=True)
+        placements = np.array(placements.rows, dtype=np.int64).reshape(-1, 2)
+        return CapacitySimulator(disks[:, 0], disks[:, 1], disks[:, 2], disks[:, 3], disks[:, 4],
+                                 [row[0] for row in queries.rows], [row[1] for row in queries.rows],
+                                 purposes.tolist(), purposeCode, placements[:, 0], placements[:, 1])
+
+    def copy(self):
+        return CapacitySimulator(self.diskIDs.copy(), self.speed.copy(), self.freeSpace.copy(), self.cost.copy(),
+                                 self.totalRAM.copy(), self.queryIDs.copy(), self.querySize.copy(), self.purposes,
+                                 self.purposeCode.copy(), self.placedQueries.copy(), self.placedDisks.copy())
+
+    # SCENARIO OPERATIONS:
+
+    def addDisks(self, count: int, speed: int, freeSpace: int, cost: int, totalRAM: int = 0) -> np.ndarray:
+        newIDs = self.nextIDs(self.diskIDs, count)
+        self.diskIDs = np.concatenate([self.diskIDs, newIDs])
+        self.speed = np.concatenate([self.speed, np.full(count, speed, dtype=np.int64)])
+        self.freeSpace = np.concatenate([self.freeSpace, np.full(count, freeSpace, dtype=np.int64)])
+        self.cost = np.concatenate([self.cost, np.full(count, cost, dtype=np.int64)])
+        self.totalRAM = np.concatenate([self.totalRAM, np.full(count, totalRAM, dtype=np.int64)])
+        return newIDs
+
+    def addQueries(self, sizes, purpose: str) -> np.ndarray:
+        sizes = np.asarray(sizes, dtype=np.int64)
+        newIDs = self.nextIDs(self.queryIDs, len(sizes))
+        if purpose not in self.purposes:
+            self.purposes.append(purpose)
+        self.queryIDs = np.concatenate([self.queryIDs, newIDs])
+        self.querySize = np.concatenate([self.querySize, sizes])
+        self.purposeCode = np.concatenate([self.purposeCode,
+                                           np.full(len(sizes), self.purposes.index(purpose), dtype=np.int64)])
+        return newIDs
+
+    # like deleteDisk, the disk's placements are dropped without freeing anything
+    def removeDisks(self, diskIDs):
+        keep = ~np.isin(self.diskIDs, diskIDs)
+        self.diskIDs, self.speed, self.freeSpace = self.diskIDs[keep], self.speed[keep], self.freeSpace[keep]
+        self.cost, self.totalRAM = self.cost[keep], self.totalRAM[keep]
+        self.keepPlacements(~np.isin(self.placedDisks, diskIDs))
+
+    # like deleteQuery, the query's size is given back to every disk it is on
+    def removeQueries(self, queryIDs):
+        removed = np.isin(self.placedQueries, queryIDs)
+        self.releasePlacements(removed)
+        self.keepPlacements(~removed)
+        keep = ~np.isin(self.queryIDs, queryIDs)
+        self.queryIDs, self.querySize, self.purposeCode = self.queryIDs[keep], self.querySize[keep], \
+            self.purposeCode[keep]
+
+    # like addQueryToDisk, placements that already exist or would overfill a disk raise a ValueError
+    def place(self, queryIDs, diskIDs):
+        queryIDs = np.asarray(queryIDs, dtype=np.int64)
+        diskIDs = np.asarray(diskIDs, dtype=np.int64)
+        queries = self.indexOf(self.queryIDs, queryIDs)
+        disks = self.indexOf(self.diskIDs, diskIDs)
+        pairs = np.stack([np.concatenate([self.placedQueries, queryIDs]),
+                          np.concatenate([self.placedDisks, diskIDs])], axis=1)
+        if len(np.unique(pairs, axis=0)) != len(pairs):
+            raise ValueError("placement already exists")
+        freeSpace = self.freeSpace.copy()
+        np.subtract.at(freeSpace, disks, self.querySize[queries])
+        if (freeSpace < 0).any():
+            raise ValueError("not enough free space on disk")
+        self.freeSpace = freeSpace
+        self.placedQueries = pairs[:, 0]
+        self.placedDisks = pairs[:, 1]
+
+    # like removeQueryFromDisk, placements that do not exist are ignored
+    def unplace(self, queryIDs, diskIDs):
+        removed = np.isin(self.placementKeys(self.placedQueries, self.placedDisks),
+                          self.placementKeys(np.asarray(queryIDs, dtype=np.int64),
+                                             np.asarray(diskIDs, dtype=np.int64)))
+        self.releasePlacements(removed)
+        self.keepPlacements(~removed)
+
+    # METRICS:
+
+    # number of queries that fit on every disk, the count mostAvailableDisks orders by
+    def fitCounts(self) -> np.ndarray:
+        return np.searchsorted(np.sort(self.querySize), self.freeSpace, side="right")
+
+    # number of queries that fit on every disk and in its RAM, the rule of getQueriesCanBeAddedToDiskAndRAM
+    def fitCountsWithRAM(self) -> np.ndarray:
+        return np.searchsorted(np.sort(self.querySize), np.minimum(self.freeSpace, self.totalRAM), side="right")
+
+    def mostAvailableDisks(self, limit: int = 5) -> List[int]:
+        order = np.lexsort((self.diskIDs, -self.speed, -self.fitCounts()))
+        return self.diskIDs[order[:limit]].tolist()
+
+    def costsForPurposes(self) -> Dict[str, int]:
+        queries = self.indexOf(self.queryIDs, self.placedQueries)
+        disks = self.indexOf(self.diskIDs, self.placedDisks)
+        totals = np.zeros(len(self.purposes), dtype=np.int64)
+        np.add.at(totals, self.purposeCode[queries], self.cost[disks] * self.querySize[queries])
+        return dict(zip(self.purposes, totals.tolist()))
+
+    def getCostForPurpose(self, purpose: str) -> int:
+        return self.costsForPurposes().get(purpose, 0)
+
+    # {metric: (before, after)} of the metrics that differ between the two simulators
+    def compare(self, other) -> Dict[str, tuple]:
+        before = self.metrics()
+        after = other.metrics()
+        return {metric: (before[metric], after[metric]) for metric in before if before[metric] != after[metric]}
+
+    def metrics(self) -> Dict[str, object]:
+        fitCounts = self.fitCounts()
+        return {
+            "mostAvailableDisks": self.mostAvailableDisks(),
+            "totalFitCount": int(fitCounts.sum()),
+            "disksWithoutFit": int((fitCounts == 0).sum()),
+            "totalFreeSpace": int(self.freeSpace.sum()),
+            "costsForPurposes": self.costsForPurposes(),
+        }
+
+    # HELPERS:
+
+    @staticmethod
+    def nextIDs(ids: np.ndarray, count: int) -> np.ndarray:
+        first = int(ids.max()) + 1 if len(ids) > 0 else 1
+        return np.arange(first, first + count, dtype=np.int64)
+
+    @staticmethod
+    def indexOf(sortedIDs: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        indices = np.searchsorted(sortedIDs, ids)
+        if (indices >= len(sortedIDs)).any() or (sortedIDs[indices] != ids).any():
+            raise ValueError("query or disk does not exist")
+        return indices
+
+    @staticmethod
+    def placementKeys(queryIDs: np.ndarray, diskIDs: np.ndarray) -> np.ndarray:
+        return queryIDs << 32 | diskIDs
+
+    def releasePlacements(self, mask: np.ndarray):
+        queries = self.indexOf(self.queryIDs, self.placedQueries[mask])
+        disks = self.indexOf(self.diskIDs, self.placedDisks[mask])
+        np.add.at(self.freeSpace, disks, self.querySize[queries])
+
+    def keepPlacements(self, mask: np.ndarray):
+        self.placedQueries = self.placedQueries[mask]
+        self.placedDisks = self.placedDisks[mask]
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Dict, Tuple, Optional, Iterator
 import Utility.DBConnector as Connector
 from Utility.ReturnValue import ReturnValue
 from Utility.Exceptions import DatabaseException
@@ -8,21 +8,31 @@ from Business.Disk import Disk
 from psycopg2 import sql
 
 
-def createTables():
+# partitions > 0 hash-partitions QueryOnDisk and RAMOnDisk by diskID into that many partitions
+def createTables(partitions: int = 0):
     conn = None
     try:
         # TABLES:
         conn = Connector.DBConnector()
+        # dictionaries of the purpose and company strings, the tables keep their integer codes:
+        sqlCreatePurposes = sql.SQL("CREATE TABLE Purposes("
+                                    "purposeID SERIAL PRIMARY KEY,"
+                                    "purpose TEXT NOT NULL UNIQUE)")
+
+        sqlCreateCompanies = sql.SQL("CREATE TABLE Companies("
+                                     "companyID SERIAL PRIMARY KEY,"
+                                     "company TEXT NOT NULL UNIQUE)")
+
         sqlCreateQueries = sql.SQL("CREATE TABLE Queries("
                                    "queryID INTEGER PRIMARY KEY,"
-                                   "purpose TEXT NOT NULL,"
+                                   "purposeID INTEGER NOT NULL REFERENCES Purposes(purposeID),"
                                    "querySize INTEGER NOT NULL,"
                                    "CHECK(queryID>0),"
                                    "CHECK(querySize>=0))")
 
         sqlCreateDisks = sql.SQL("CREATE TABLE Disks("
                                  "diskID INTEGER PRIMARY KEY,"
-                                 "diskCompany TEXT NOT NULL,"
+                                 "diskCompanyID INTEGER NOT NULL REFERENCES Companies(companyID),"
                                  "speed INTEGER NOT NULL,"
                                  "freeSpace INTEGER NOT NULL,"
                                  "costPerByte INTEGER NOT NULL,"
@@ -34,56 +44,54 @@ def createTables():
         sqlCreateRAMs = sql.SQL("CREATE TABLE RAMs("
                                 "ramID INTEGER PRIMARY KEY,"
                                 "ramSize INTEGER NOT NULL,"
-                                "ramCompany TEXT NOT NULL,"
+                                "ramCompanyID INTEGER NOT NULL REFERENCES Companies(companyID),"
                                 "CHECK(ramID>0),"
                                 "CHECK(ramSize>0))")
 
-        sqlCreateQueryOnDisk = sql.SQL("CREATE TABLE QueryOnDisk("
-                                       "queryID INTEGER,"
-                                       "diskID INTEGER,"
-                                       "PRIMARY KEY(queryID, diskID),"
-                                       "FOREIGN KEY(queryID) REFERENCES Queries(queryID) ON DELETE CASCADE,"
-                                       "FOREIGN KEY(diskID) REFERENCES Disks(diskID) ON DELETE CASCADE)")
-
-        sqlCreateRAMOnDisk = sql.SQL("CREATE TABLE RAMOnDisk("
-                                     "ramID INTEGER,"
-                                     "diskID INTEGER,"
-                                     "PRIMARY KEY(ramID, diskID),"
-                                     "FOREIGN KEY(ramID) REFERENCES RAMs(ramID) ON DELETE CASCADE,"
-                                     "FOREIGN KEY(diskID) REFERENCES Disks(diskID) ON DELETE CASCADE)")
-
-        # VIEWS:
-        sqlCreateRunningQueriesView = sql.SQL("CREATE VIEW RunningQueries AS "
-                                              "SELECT Q.queryID, querySize, purpose, D.diskID, costPerByte "
-                                              "FROM Queries Q, QueryOnDisk QD, Disks D "
-                                              "WHERE Q.queryID = QD.queryID AND QD.diskID = D.diskID")
-
-        sqlCreateRunningRAMsView = sql.SQL("CREATE VIEW RunningRAMs AS "
-                                           "SELECT R.ramID, R.ramCompany, D.diskID, D.diskCompany "
-                                           "FROM Rams R, RAMOnDisk RD, Disks D "
-                                           "WHERE R.ramID = RD.ramID AND RD.diskID = D.diskID")
-
-        sqlRunableQueriesView = sql.SQL("CREATE VIEW RunableQueries AS "
-                                        "SELECT D.diskID, Q.queryID, Q.querySize "
-                                        "FROM Queries Q, Disks D "
-                                        "WHERE Q.querySize <= D.freeSpace ")
-
-        sqlTotalRAMView = sql.SQL("CREATE VIEW TotalRAM AS "
-                                  "SELECT D.diskID, (SELECT COALESCE(SUM(R.ramSize), 0) FROM RAMOnDisk RD, RAMs R WHERE R.ramID = RD.ramID AND RD.diskID = D.diskID) AS totalRAM "
-                                  "FROM Disks D ")
-
-        sqlMutualDisksView = sql.SQL("CREATE VIEW MutualDisks AS "
-                                     "SELECT Q1.queryID AS queryID1, Q2.queryID AS queryID2, (SELECT COUNT(*) FROM QueryOnDisk QD1, QueryOnDisk QD2 "
-                                     "WHERE QD1.queryID = Q1.queryID AND QD2.queryID = Q2.queryID AND QD1.diskID = QD2.diskID) AS disksNum "
-                                     "FROM Queries Q1, Queries Q2")
-
-        transaction = createTransaction([sqlCreateQueries, sqlCreateDisks, sqlCreateRAMs,
-                                         sqlCreateQueryOnDisk, sqlCreateRAMOnDisk, sqlCreateRunningQueriesView,
-                                         sqlCreateRunningRAMsView, sqlRunableQueriesView, sqlTotalRAMView,
-                                         sqlMutualDisksView])
+        # number of disks every placed query is on:
+        sqlCreateQueryReplicas = sql.SQL("CREATE TABLE QueryReplicas("
+                                         "queryID INTEGER PRIMARY KEY,"
+                                         "disksNum INTEGER NOT NULL,"
+                                         "CHECK(disksNum>0),"
+                                         "FOREIGN KEY(queryID) REFERENCES Queries(queryID) ON DELETE CASCADE)")
+
+        # number of queries on the disk that are also on another disk, only conflicting disks have a row:
+        sqlCreateDiskConflicts = sql.SQL("CREATE TABLE DiskConflicts("
+                                         "diskID INTEGER PRIMARY KEY,"
+                                         "sharedQueries INTEGER NOT NULL,"
+                                         "CHECK(sharedQueries>=0),"
+                                         "FOREIGN KEY(diskID) REFERENCES Disks(diskID) ON DELETE CASCADE)")
+
+        # every disk that became (TRUE) or stopped being (FALSE) conflicting, ordered by version. Versions are
+        # taken at insert time, not in commit order, so readers page by the writing transaction's txid instead:
+        sqlCreateConflictLog = sql.SQL("CREATE TABLE ConflictLog("
+                                       "version BIGSERIAL PRIMARY KEY,"
+                                       "txid BIGINT NOT NULL DEFAULT txid_current(),"
+                                       "diskID INTEGER NOT NULL,"
+                                       "isConflicting BOOLEAN NOT NULL)")
+        sqlCreateConflictLogIndex = sql.SQL("CREATE INDEX ConflictLogTxidIndex ON ConflictLog(txid)")
+
+        # queries waiting to be placed, a claimed query is hidden from other workers until visibleAt:
+        sqlCreatePlacementQueue = sql.SQL("CREATE TABLE PlacementQueue("
+                                          "queryID INTEGER PRIMARY KEY,"
+                                          "claimedBy TEXT,"
+                                          "visibleAt TIMESTAMPTZ NOT NULL DEFAULT '-infinity',"
+                                          "FOREIGN KEY(queryID) REFERENCES Queries(queryID) ON DELETE CASCADE)")
+        sqlCreatePlacementQueueIndex = sql.SQL("CREATE INDEX PlacementQueueVisibleIndex "
+                                               "ON PlacementQueue(visibleAt, queryID)")
+
+        transaction = createTransaction([sqlCreatePurposes, sqlCreateCompanies, sqlCreateQueries, sqlCreateDisks,
+                                         sqlCreateRAMs] +
+                                        createPlacementTablesSql(partitions) +
+                                        [sqlCreateQueryReplicas, sqlCreateDiskConflicts, sqlCreateConflictLog,
+                                         sqlCreateConflictLogIndex, sqlCreatePlacementQueue,
+                                         sqlCreatePlacementQueueIndex] +
+                                        createViewsSql())
         conn.execute(transaction)
         conn.commit()
     finally:
+        purposeCodes.clear()
+        companyCodes.clear()
         conn.close()
 
 
@@ -91,13 +99,10 @@ def clearTables():
     conn = None
     try:
         conn = Connector.DBConnector()
-        sqlClearQueries = sql.SQL("DELETE FROM Queries CASCADE")
-        sqlClearDisks = sql.SQL("DELETE FROM Disks CASCADE")
-        sqlClearRAMs = sql.SQL("DELETE FROM RAMs CASCADE")
-        sqlClearQueryOnDisk = sql.SQL("DELETE FROM QueryOnDisk CASCADE")
-        sqlClearRAMOnDisk = sql.SQL("DELETE FROM RAMOnDisk CASCADE")
-        transaction = createTransaction([sqlClearQueries, sqlClearDisks, sqlClearRAMs,
-                                         sqlClearQueryOnDisk, sqlClearRAMOnDisk])
+        # the Purposes and Companies dictionaries are kept, so codes cached by any process stay valid:
+        sqlClearTables = sql.SQL("TRUNCATE Queries, Disks, RAMs, QueryOnDisk, RAMOnDisk, QueryReplicas, "
+                                 "DiskConflicts, ConflictLog, PlacementQueue RESTART IDENTITY")
+        transaction = createTransaction([sqlClearTables])
         conn.execute(transaction)
         conn.commit()
     finally:
@@ -114,6 +119,12 @@ def dropTables():
         sqlDropRAMs = sql.SQL("DROP TABLE IF EXISTS RAMs CASCADE")
         sqlDropQueryOnDisk = sql.SQL("DROP TABLE IF EXISTS QueryOnDisk CASCADE")
         sqlDropRAMOnDisk = sql.SQL("DROP TABLE IF EXISTS RAMOnDisk CASCADE")
+        sqlDropQueryReplicas = sql.SQL("DROP TABLE IF EXISTS QueryReplicas CASCADE")
+        sqlDropDiskConflicts = sql.SQL("DROP TABLE IF EXISTS DiskConflicts CASCADE")
+        sqlDropConflictLog = sql.SQL("DROP TABLE IF EXISTS ConflictLog CASCADE")
+        sqlDropPlacementQueue = sql.SQL("DROP TABLE IF EXISTS PlacementQueue CASCADE")
+        sqlDropPurposes = sql.SQL("DROP TABLE IF EXISTS Purposes CASCADE")
+        sqlDropCompanies = sql.SQL("DROP TABLE IF EXISTS Companies CASCADE")
         # VIEWS:
         sqlDropRunningQueriesView = sql.SQL("DROP TABLE IF EXISTS RunningQueries CASCADE")
         sqlDropTotalRAMView = sql.SQL("DROP TABLE IF EXISTS TotalRAM CASCADE")
@@ -122,15 +133,94 @@ def dropTables():
         sqlDropMutualDisksView = sql.SQL("DROP TABLE IF EXISTS MutualDisks CASCADE")
 
         transaction = createTransaction([sqlDropQueries, sqlDropDisks, sqlDropRAMs,
-                                         sqlDropQueryOnDisk, sqlDropRAMOnDisk, sqlDropRunningQueriesView,
+                                         sqlDropQueryOnDisk, sqlDropRAMOnDisk, sqlDropQueryReplicas,
+                                         sqlDropDiskConflicts, sqlDropConflictLog, sqlDropPlacementQueue,
+                                         sqlDropRunningQueriesView,
                                          sqlDropTotalRAMView,
-                                         sqlDropRunningRAMsView, sqlDropRunableQueriesView, sqlDropMutualDisksView])
+                                         sqlDropRunningRAMsView, sqlDropRunableQueriesView, sqlDropMutualDisksView,
+                                         sqlDropPurposes, sqlDropCompanies])
+        conn.execute(transaction)
+        conn.commit()
+    finally:
+        purposeCodes.clear()
+        companyCodes.clear()
+        conn.close()
+
+
+# migrates QueryOnDisk and RAMOnDisk in place to the given number of hash partitions, 0 makes them unpartitioned
+def repartitionPlacementTables(partitions: int):
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        sqlSaveQueryOnDisk = sql.SQL("CREATE TEMP TABLE SavedQueryOnDisk ON COMMIT DROP AS SELECT * FROM QueryOnDisk")
+        sqlSaveRAMOnDisk = sql.SQL("CREATE TEMP TABLE SavedRAMOnDisk ON COMMIT DROP AS SELECT * FROM RAMOnDisk")
+        # the views depend on the placement tables, so they are dropped with them and created again:
+        sqlDropQueryOnDisk = sql.SQL("DROP TABLE QueryOnDisk CASCADE")
+        sqlDropRAMOnDisk = sql.SQL("DROP TABLE RAMOnDisk CASCADE")
+        sqlDropViews = sql.SQL("DROP VIEW IF EXISTS RunningQueries, RunningRAMs, RunableQueries, TotalRAM, "
+                               "MutualDisks CASCADE")
+        sqlRestoreQueryOnDisk = sql.SQL("INSERT INTO QueryOnDisk(queryID, diskID) "
+                                        "SELECT queryID, diskID FROM SavedQueryOnDisk")
+        sqlRestoreRAMOnDisk = sql.SQL("INSERT INTO RAMOnDisk(ramID, diskID) SELECT ramID, diskID FROM SavedRAMOnDisk")
+        transaction = createTransaction([sqlSaveQueryOnDisk, sqlSaveRAMOnDisk, sqlDropQueryOnDisk, sqlDropRAMOnDisk,
+                                         sqlDropViews] + createPlacementTablesSql(partitions) +
+                                        [sqlRestoreQueryOnDisk, sqlRestoreRAMOnDisk] + createViewsSql())
         conn.execute(transaction)
         conn.commit()
     finally:
         conn.close()
 
 
+# creates a database with the schema (and whatever seed() adds through the Solution functions) to clone from.
+# Switches Connector.DBConnector.database while seeding, so it must not run alongside other Solution calls
+def createTemplateDatabase(template: str, partitions: int = 0, seed=None):
+    conn = None
+    try:
+        conn = Connector.DBConnector(autocommit=True)
+        conn.execute(sql.SQL("CREATE DATABASE {template}").format(template=sql.Identifier(template)))
+    finally:
+        conn.close()
+    database = Connector.DBConnector.database
+    Connector.DBConnector.database = template
+    try:
+        createTables(partitions)
+        if seed is not None:
+            seed()
+    finally:
+        Connector.DBConnector.database = database
+        purposeCodes.clear()
+        companyCodes.clear()
+
+
+# creates an isolated database as a file level copy of the template, point Connector.DBConnector.database at
+# it to use it. The template must have no open connections
+def cloneDatabase(template: str, name: str):
+    conn = None
+    try:
+        conn = Connector.DBConnector(autocommit=True)
+        conn.execute(sql.SQL("CREATE DATABASE {name} TEMPLATE {template}").format(name=sql.Identifier(name),
+                                                                                   template=sql.Identifier(template)))
+    finally:
+        forgetCodes(name)
+        conn.close()
+
+
+def dropDatabase(name: str):
+    conn = None
+    try:
+        conn = Connector.DBConnector(autocommit=True)
+        conn.execute(sql.SQL("DROP DATABASE IF EXISTS {name}").format(name=sql.Identifier(name)))
+    finally:
+        forgetCodes(name)
+        conn.close()
+
+
+# drops the cached codes of the database, a new database of the same name may have other ones
+def forgetCodes(database: str):
+    for caches in [purposeCodes, companyCodes]:
+        caches.pop((Connector.DBConnector.section, database), None)
+
+
 def addQuery(query: Query) -> ReturnValue:
     conn = None
     queryID = query.getQueryID()
@@ -140,8 +230,9 @@ def addQuery(query: Query) -> ReturnValue:
     try:
         conn = Connector.DBConnector()
         sqlQuery = sql.SQL(
-            "INSERT INTO Queries(queryID, purpose, querySize) VALUES({queryID}, {purpose}, {querySize});") \
-            .format(queryID=sql.Literal(queryID), purpose=sql.Literal(purpose), querySize=sql.Literal(querySize))
+            "INSERT INTO Queries(queryID, purposeID, querySize) VALUES({queryID}, {purposeID}, {querySize});") \
+            .format(queryID=sql.Literal(queryID), purposeID=sql.Literal(purposeCode(purpose)),
+                    querySize=sql.Literal(querySize))
 
         rows_affected, _ = conn.execute(sqlQuery)
         conn.commit()
@@ -169,7 +260,9 @@ def getQueryProfile(queryID: int) -> Query:
     query = None
     try:
         conn = Connector.DBConnector()
-        sqlQuery = sql.SQL(f"SELECT * FROM Queries WHERE queryID = {queryID}").format(queryID=sql.Literal(queryID))
+        sqlQuery = sql.SQL("SELECT Q.queryID, P.purpose, Q.querySize FROM Queries Q, Purposes P "
+                           "WHERE Q.queryID = {queryID} AND P.purposeID = Q.purposeID").format(
+            queryID=sql.Literal(queryID))
         rows_affected, result = conn.execute(sqlQuery)
         conn.commit()
         query = queryFromResult(result)
@@ -180,6 +273,27 @@ def getQueryProfile(queryID: int) -> Query:
         return query
 
 
+def getQueryProfiles(queryIDs: List[int]) -> Dict[int, Query]:
+    conn = None
+    queries = {queryID: Query.badQuery() for queryID in queryIDs}
+    try:
+        conn = Connector.DBConnector()
+        sqlQuery = sql.SQL("SELECT Q.queryID, P.purpose, Q.querySize FROM Queries Q, Purposes P "
+                           "WHERE Q.queryID = ANY({queryIDs}::INTEGER[]) AND P.purposeID = Q.purposeID").format(
+            queryIDs=sql.Literal(list(queries)))
+        rows_affected, result = conn.execute(sqlQuery)
+        conn.commit()
+        for i in range(result.size()):
+            query = queryFromRow(result[i])
+            queries[query.getQueryID()] = query
+    except Exception as e:
+        queries = {queryID: Query.badQuery() for queryID in queryIDs}
+    finally:
+        if conn is not None:
+            conn.close()
+        return queries
+
+
 def deleteQuery(query: Query) -> ReturnValue:
     conn = None
     retValue = None
@@ -193,7 +307,8 @@ def deleteQuery(query: Query) -> ReturnValue:
 
         queryDeleteSql = sql.SQL("DELETE FROM Queries WHERE QueryID={0} ").format(sql.Literal(queryID))
 
-        sqlQuery = createTransaction([queryUpdateSql, queryDeleteSql])
+        sqlQuery = createTransaction(lockReplicasSql(sql.Literal([queryID])) + [queryUpdateSql] +
+                                     conflictsOnQueryDeleted(queryID) + [queryDeleteSql])
         rows_effected, _ = conn.execute(sqlQuery)
         retValue = ReturnValue.OK
         conn.commit()
@@ -215,10 +330,10 @@ def addDisk(disk: Disk) -> ReturnValue:
     costPerByte = disk.getCost()
     try:
         conn = Connector.DBConnector()
-        sqlQuery = sql.SQL("INSERT INTO Disks(diskID, diskCompany, speed, freeSpace, costPerByte)"
-                           "VALUES({diskID}, {diskCompany}, {speed}, {freeSpace}, {costPerByte})") \
-            .format(diskID=sql.Literal(diskID), diskCompany=sql.Literal(diskCompany), speed=sql.Literal(speed),
-                    freeSpace=sql.Literal(freeSpace), costPerByte=sql.Literal(costPerByte))
+        sqlQuery = sql.SQL("INSERT INTO Disks(diskID, diskCompanyID, speed, freeSpace, costPerByte)"
+                           "VALUES({diskID}, {diskCompanyID}, {speed}, {freeSpace}, {costPerByte})") \
+            .format(diskID=sql.Literal(diskID), diskCompanyID=sql.Literal(companyCode(diskCompany)),
+                    speed=sql.Literal(speed), freeSpace=sql.Literal(freeSpace), costPerByte=sql.Literal(costPerByte))
 
         rows_affected, _ = conn.execute(sqlQuery)
         conn.commit()
@@ -247,8 +362,8 @@ def getDiskProfile(diskID: int) -> Disk:
     try:
         conn = Connector.DBConnector()
         sqlQuery = sql.SQL(
-            f"SELECT diskID, diskCompany, speed, freeSpace, costPerByte  FROM Disks WHERE diskID = {diskID}").format(
-            queryID=sql.Literal(diskID))
+            "SELECT D.diskID, C.company AS diskCompany, D.speed, D.freeSpace, D.costPerByte FROM Disks D, Companies C "
+            "WHERE D.diskID = {diskID} AND C.companyID = D.diskCompanyID").format(diskID=sql.Literal(diskID))
         rows_affected, result = conn.execute(sqlQuery)
         conn.commit()
         disk = diskFromResult(result)
@@ -259,11 +374,34 @@ def getDiskProfile(diskID: int) -> Disk:
         return disk
 
 
+def getDiskProfiles(diskIDs: List[int]) -> Dict[int, Disk]:
+    conn = None
+    disks = {diskID: Disk.badDisk() for diskID in diskIDs}
+    try:
+        conn = Connector.DBConnector()
+        sqlQuery = sql.SQL("SELECT D.diskID, C.company AS diskCompany, D.speed, D.freeSpace, D.costPerByte "
+                           "FROM Disks D, Companies C "
+                           "WHERE D.diskID = ANY({diskIDs}::INTEGER[]) AND C.companyID = D.diskCompanyID").format(
+            diskIDs=sql.Literal(list(disks)))
+        rows_affected, result = conn.execute(sqlQuery)
+        conn.commit()
+        for i in range(result.size()):
+            disk = diskFromRow(result[i])
+            disks[disk.getDiskID()] = disk
+    except Exception as e:
+        disks = {diskID: Disk.badDisk() for diskID in diskIDs}
+    finally:
+        if conn is not None:
+            conn.close()
+        return disks
+
+
 def deleteDisk(diskID: int) -> ReturnValue:
     conn = None
     retValue = None
     try:
         conn = Connector.DBConnector()
+        conn.execute(sql.SQL('; ').join(conflictsOnDiskDeleted(diskID)))
         sqlQuery = sql.SQL("DELETE FROM Disks WHERE diskID={0}").format(sql.Literal(diskID))
         rows_effected, _ = conn.execute(sqlQuery)
         conn.commit()
@@ -273,6 +411,7 @@ def deleteDisk(diskID: int) -> ReturnValue:
             retValue = ReturnValue.OK
     except Exception as e:
         retValue = ReturnValue.ERROR
+        conn.rollback()
     finally:
         conn.close()
         return retValue
@@ -286,9 +425,10 @@ def addRAM(ram: RAM) -> ReturnValue:
     ramSize = ram.getSize()
     try:
         conn = Connector.DBConnector()
-        sqlQuery = sql.SQL("INSERT INTO RAMs(ramID, ramCompany, ramSize)"
-                           "VALUES({ramID}, {ramCompany}, {ramSize})") \
-            .format(ramID=sql.Literal(ramID), ramCompany=sql.Literal(ramCompany), ramSize=sql.Literal(ramSize))
+        sqlQuery = sql.SQL("INSERT INTO RAMs(ramID, ramCompanyID, ramSize)"
+                           "VALUES({ramID}, {ramCompanyID}, {ramSize})") \
+            .format(ramID=sql.Literal(ramID), ramCompanyID=sql.Literal(companyCode(ramCompany)),
+                    ramSize=sql.Literal(ramSize))
 
         rows_affected, _ = conn.execute(sqlQuery)
         conn.commit()
@@ -315,7 +455,8 @@ def getRAMProfile(ramID: int) -> RAM:
     ram = None
     try:
         conn = Connector.DBConnector()
-        sqlQuery = sql.SQL(f"SELECT * FROM RAMs WHERE ramID = {ramID}").format(queryID=sql.Literal(ramID))
+        sqlQuery = sql.SQL("SELECT R.ramID, C.company AS ramCompany, R.ramSize FROM RAMs R, Companies C "
+                           "WHERE R.ramID = {ramID} AND C.companyID = R.ramCompanyID").format(ramID=sql.Literal(ramID))
         rows_affected, result = conn.execute(sqlQuery)
         conn.commit()
         ram = ramFromResult(result)
@@ -326,6 +467,27 @@ def getRAMProfile(ramID: int) -> RAM:
         return ram
 
 
+def getRAMProfiles(ramIDs: List[int]) -> Dict[int, RAM]:
+    conn = None
+    rams = {ramID: RAM.badRAM() for ramID in ramIDs}
+    try:
+        conn = Connector.DBConnector()
+        sqlQuery = sql.SQL("SELECT R.ramID, C.company AS ramCompany, R.ramSize FROM RAMs R, Companies C "
+                           "WHERE R.ramID = ANY({ramIDs}::INTEGER[]) AND C.companyID = R.ramCompanyID").format(
+            ramIDs=sql.Literal(list(rams)))
+        rows_affected, result = conn.execute(sqlQuery)
+        conn.commit()
+        for i in range(result.size()):
+            ram = ramFromRow(result[i])
+            rams[ram.getRamID()] = ram
+    except Exception as e:
+        rams = {ramID: RAM.badRAM() for ramID in ramIDs}
+    finally:
+        if conn is not None:
+            conn.close()
+        return rams
+
+
 def deleteRAM(ramID: int) -> ReturnValue:
     conn = None
     retValue = None
@@ -358,14 +520,15 @@ def addDiskAndQuery(disk: Disk, query: Query) -> ReturnValue:
     costPerByte = disk.getCost()
     try:
         conn = Connector.DBConnector()
-        disksInsertQuery = sql.SQL("INSERT INTO Disks(diskID, diskCompany, speed, freeSpace, costPerByte)"
-                                   "VALUES({diskID}, {diskCompany}, {speed}, {freeSpace}, {costPerByte})") \
-            .format(diskID=sql.Literal(diskID), diskCompany=sql.Literal(diskCompany), speed=sql.Literal(speed),
-                    freeSpace=sql.Literal(freeSpace), costPerByte=sql.Literal(costPerByte))
+        disksInsertQuery = sql.SQL("INSERT INTO Disks(diskID, diskCompanyID, speed, freeSpace, costPerByte)"
+                                   "VALUES({diskID}, {diskCompanyID}, {speed}, {freeSpace}, {costPerByte})") \
+            .format(diskID=sql.Literal(diskID), diskCompanyID=sql.Literal(companyCode(diskCompany)),
+                    speed=sql.Literal(speed), freeSpace=sql.Literal(freeSpace), costPerByte=sql.Literal(costPerByte))
 
         queriesInsertQuery = sql.SQL(
-            "INSERT INTO Queries(queryID, purpose, querySize) VALUES({queryID}, {purpose}, {querySize});") \
-            .format(queryID=sql.Literal(queryID), purpose=sql.Literal(purpose), querySize=sql.Literal(querySize))
+            "INSERT INTO Queries(queryID, purposeID, querySize) VALUES({queryID}, {purposeID}, {querySize});") \
+            .format(queryID=sql.Literal(queryID), purposeID=sql.Literal(purposeCode(purpose)),
+                    querySize=sql.Literal(querySize))
 
         transaction = createTransaction([disksInsertQuery, queriesInsertQuery])
         rows_effected, _ = conn.execute(transaction)
@@ -401,15 +564,7 @@ def addQueryToDisk(query: Query, diskID: int) -> ReturnValue:
     retValue = None
     try:
         conn = Connector.DBConnector()
-        sqlUpdateQuery = sql.SQL("UPDATE Disks SET freeSpace = freeSpace - {querySize}"
-                                 " WHERE diskID={diskID}") \
-            .format(diskID=sql.Literal(diskID), querySize=sql.Literal(querySize))
-
-        sqlInsertQuery = sql.SQL("INSERT INTO QueryOnDisk(queryID, diskID) VALUES("
-                                 "{queryID}, {diskID})").format(queryID=sql.Literal(queryID),
-                                                                diskID=sql.Literal(diskID))
-
-        transaction = createTransaction([sqlInsertQuery, sqlUpdateQuery])
+        transaction = createTransaction(addQueryToDiskSql(queryID, querySize, diskID))
         conn.execute(transaction)
         retValue = ReturnValue.OK
         conn.commit()
@@ -437,14 +592,7 @@ def removeQueryFromDisk(query: Query, diskID: int) -> ReturnValue:
     querySize = query.getSize()
     try:
         conn = Connector.DBConnector()
-        sqlUpdateQuery = sql.SQL("UPDATE Disks SET freeSpace = freeSpace + {querySize} WHERE diskID IN "
-                                 "(SELECT diskID FROM QueryOnDisk WHERE diskID={diskID} AND queryID={queryID})") \
-            .format(diskID=sql.Literal(diskID), queryID=sql.Literal(queryID), querySize=sql.Literal(querySize))
-
-        sqlDeleteQuery = sql.SQL("DELETE FROM QueryOnDisk WHERE queryID = {queryID} AND diskID = {diskID}") \
-            .format(queryID=sql.Literal(queryID), diskID=sql.Literal(diskID))
-
-        transaction = createTransaction([sqlUpdateQuery, sqlDeleteQuery])
+        transaction = createTransaction(removeQueryFromDiskSql(queryID, querySize, diskID))
         conn.execute(transaction)
         conn.commit()
         retValue = ReturnValue.OK
@@ -464,11 +612,7 @@ def addRAMToDisk(ramID: int, diskID: int) -> ReturnValue:
     retValue = None
     try:
         conn = Connector.DBConnector()
-        sqlInsertRAM = sql.SQL("INSERT INTO RAMOnDisk(ramID, diskID) VALUES("
-                               "{ramID}, {diskID})").format(ramID=sql.Literal(ramID),
-                                                            diskID=sql.Literal(diskID))
-
-        transaction = createTransaction([sqlInsertRAM])
+        transaction = createTransaction(addRAMToDiskSql(ramID, diskID))
         conn.execute(transaction)
         conn.commit()
         retValue = ReturnValue.OK
@@ -494,11 +638,7 @@ def removeRAMFromDisk(ramID: int, diskID: int) -> ReturnValue:
     retValue = None
     try:
         conn = Connector.DBConnector()
-
-        sqlDeleteQuery = sql.SQL("DELETE FROM RAMOnDisk WHERE ramID = {ramID} AND diskID = {diskID}") \
-            .format(ramID=sql.Literal(ramID), diskID=sql.Literal(diskID))
-
-        rows_affected, _ = conn.execute(sqlDeleteQuery)
+        rows_affected, _ = conn.execute(sql.SQL('; ').join(removeRAMFromDiskSql(ramID, diskID)))
         conn.commit()
         if rows_affected == 0:
             retValue = ReturnValue.NOT_EXISTS
@@ -562,8 +702,9 @@ def getCostForPurpose(purpose: str) -> int:
     cost = None
     try:
         conn = Connector.DBConnector()
+        purposeID = purposeCode(purpose, create=False)
         sqlQuery = sql.SQL("SELECT SUM(costPerByte*querySize) FROM RunningQueries "
-                           "WHERE purpose = {purpose}").format(purpose=sql.Literal(purpose))
+                           "WHERE purposeID = {purposeID}").format(purposeID=sql.Literal(purposeID))
 
         rows_affected, result = conn.execute(sqlQuery)
         conn.commit()
@@ -620,7 +761,7 @@ def isCompanyExclusive(diskID: int) -> bool:
     isExclusive = None
     try:
         conn = Connector.DBConnector()
-        sqlQuery = sql.SQL("SELECT diskCompany FROM Disks WHERE diskID={diskID} UNION SELECT ramCompany FROM RunningRAMs "
+        sqlQuery = sql.SQL("SELECT diskCompanyID FROM Disks WHERE diskID={diskID} UNION SELECT ramCompanyID FROM RunningRAMs "
                            "WHERE diskId={diskID} ").format(diskID=sql.Literal(diskID))
         rows_affected, result = conn.execute(sqlQuery)
         conn.commit()
@@ -635,14 +776,108 @@ def isCompanyExclusive(diskID: int) -> bool:
         return isExclusive
 
 
+def getCompanyExclusivity(diskIDs: Optional[List[int]] = None) -> Dict[int, Tuple[bool, List[str]]]:
+    conn = None
+    res = {}
+    try:
+        conn = Connector.DBConnector()
+        if diskIDs is None:
+            sqlFilter = sql.SQL("")
+        else:
+            res = {diskID: (False, []) for diskID in diskIDs}
+            sqlFilter = sql.SQL("WHERE D.diskID = ANY({diskIDs}::INTEGER[]) ").format(diskIDs=sql.Literal(list(res)))
+        sqlQuery = sql.SQL("SELECT D.diskID, COALESCE(ARRAY_AGG(DISTINCT C.company) "
+                           "FILTER (WHERE R.ramCompanyID <> D.diskCompanyID), '{{}}') AS foreignCompanies "
+                           "FROM Disks D LEFT JOIN RAMOnDisk RD ON RD.diskID = D.diskID "
+                           "LEFT JOIN RAMs R ON R.ramID = RD.ramID "
+                           "LEFT JOIN Companies C ON C.companyID = R.ramCompanyID "
+                           "{filter}"
+                           "GROUP BY D.diskID").format(filter=sqlFilter)
+        rows_affected, result = conn.execute(sqlQuery)
+        conn.commit()
+        for i in range(result.size()):
+            foreignCompanies = result[i]['foreignCompanies']
+            res[result[i]['diskID']] = (len(foreignCompanies) == 0, foreignCompanies)
+    except Exception as e:
+        res = {} if diskIDs is None else {diskID: (False, []) for diskID in diskIDs}
+    finally:
+        if conn is not None:
+            conn.close()
+        return res
+
+
+# yields one record per disk, for all disks or the given ones, ordered by diskID. Everything is computed by one
+# statement whose rows are streamed, fitCount is the count mostAvailableDisks orders by
+def getDiskDashboard(diskIDs: Optional[List[int]] = None) -> Iterator[Dict[str, object]]:
+    conn = None
+
+    def diskFilter(column: str) -> sql.Composable:
+        if diskIDs is None:
+            return sql.SQL("")
+        return sql.SQL("AND {column} = ANY({diskIDs}::INTEGER[]) ").format(column=sql.SQL(column),
+                                                                           diskIDs=sql.Literal(list(diskIDs)))
+
+    try:
+        conn = Connector.DBConnector()
+        # disks and query sizes are sorted together with queries before disks of the same size, so the running
+        # count of queries at a disk's row is the number of queries that fit in its free space:
+        sqlQuery = sql.SQL("WITH RAMStats AS ("
+                           "SELECT RD.diskID, SUM(R.ramSize) AS totalRAM, "
+                           "BOOL_OR(R.ramCompanyID <> D.diskCompanyID) AS hasForeignRAM "
+                           "FROM RAMOnDisk RD, RAMs R, Disks D "
+                           "WHERE R.ramID = RD.ramID AND D.diskID = RD.diskID {ramFilter}"
+                           "GROUP BY RD.diskID), "
+                           "QueryStats AS ("
+                           "SELECT QD.diskID, COUNT(*) AS queriesNum, AVG(Q.querySize) AS averageQuerySize "
+                           "FROM QueryOnDisk QD, Queries Q "
+                           "WHERE Q.queryID = QD.queryID {queryFilter}"
+                           "GROUP BY QD.diskID), "
+                           "FitCounts AS ("
+                           "SELECT diskID, fitCount FROM ("
+                           "SELECT diskID, SUM(1 - isDisk) OVER (ORDER BY size, isDisk "
+                           "ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS fitCount "
+                           "FROM (SELECT NULL::INTEGER AS diskID, querySize AS size, 0 AS isDisk FROM Queries "
+                           "UNION ALL SELECT diskID, freeSpace, 1 FROM Disks WHERE TRUE {fitFilter}) Sizes) Running "
+                           "WHERE diskID IS NOT NULL) "
+                           "SELECT D.diskID, D.freeSpace, D.speed, D.costPerByte, "
+                           "COALESCE(RS.totalRAM, 0) AS totalRAM, "
+                           "COALESCE(QS.queriesNum, 0) AS queriesNum, "
+                           "COALESCE(QS.averageQuerySize, 0) AS averageQuerySize, "
+                           "NOT COALESCE(RS.hasForeignRAM, FALSE) AS isCompanyExclusive, "
+                           "FC.fitCount "
+                           "FROM Disks D JOIN FitCounts FC ON FC.diskID = D.diskID "
+                           "LEFT JOIN RAMStats RS ON RS.diskID = D.diskID "
+                           "LEFT JOIN QueryStats QS ON QS.diskID = D.diskID "
+                           "WHERE TRUE {diskFilter}"
+                           "ORDER BY D.diskID").format(ramFilter=diskFilter("RD.diskID"),
+                                                       queryFilter=diskFilter("QD.diskID"),
+                                                       fitFilter=diskFilter("diskID"),
+                                                       diskFilter=diskFilter("D.diskID"))
+        for row in conn.stream(sqlQuery):
+            yield {"diskID": row['diskID'], "freeSpace": row['freeSpace'], "speed": row['speed'],
+                   "costPerByte": row['costPerByte'], "totalRAM": row['totalRAM'], "queriesNum": row['queriesNum'],
+                   "averageQuerySize": row['averageQuerySize'], "isCompanyExclusive": row['isCompanyExclusive'],
+                   "fitCount": row['fitCount']}
+        conn.commit()
+    except Exception as e:
+        # like the other functions, a database error is not raised, the iteration just ends:
+        if conn is not None:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+    finally:
+        if conn is not None:
+            conn.close()
+
+
 def getConflictingDisks() -> List[int]:
     conn = None
     res = []
     try:
         conn = Connector.DBConnector()
-        sqlQuery = sql.SQL("SELECT DISTINCT L.diskID FROM QueryOnDisk R, QueryOnDisk L "
-                           "WHERE L.queryId=R.queryId AND L.diskID <> R.diskID "
-                           "ORDER BY L.diskID ASC ").format()
+        sqlQuery = sql.SQL("SELECT diskID FROM DiskConflicts "
+                           "ORDER BY diskID ASC ").format()
         rows_affected, result = conn.execute(sqlQuery)
         res = [result.__getitem__(i)['diskID'] for i in range(result.size())]
         conn.commit()
@@ -651,6 +886,172 @@ def getConflictingDisks() -> List[int]:
         return res
 
 
+# returns the disks that became and stopped being conflicting since the version returned by the previous call,
+# and the version to pass to the next one, start from 0. A version is a txid below which every transaction has
+# ended, so entries committed after the call by transactions that were in flight are returned by the next one
+def getConflictingDisksChanges(sinceVersion: int) -> Tuple[int, List[int], List[int]]:
+    conn = None
+    res = (sinceVersion, [], [])
+    try:
+        conn = Connector.DBConnector()
+        sqlVersion = sql.SQL("SELECT GREATEST(txid_snapshot_xmin(txid_current_snapshot()), {sinceVersion}) "
+                             "AS version").format(sinceVersion=sql.Literal(sinceVersion))
+        rows_affected, result = conn.execute(sqlVersion)
+        version = result[0]['version']
+        # a disk's log entries alternate, so it changed only if its first and last entries agree:
+        sqlQuery = sql.SQL("SELECT diskID, (ARRAY_AGG(isConflicting ORDER BY version ASC))[1] AS first, "
+                           "(ARRAY_AGG(isConflicting ORDER BY version DESC))[1] AS last "
+                           "FROM ConflictLog "
+                           "WHERE txid >= {sinceVersion} AND txid < {version} "
+                           "GROUP BY diskID "
+                           "ORDER BY diskID ASC").format(sinceVersion=sql.Literal(sinceVersion),
+                                                         version=sql.Literal(version))
+        rows_affected, result = conn.execute(sqlQuery)
+        conn.commit()
+        rows = [result[i] for i in range(result.size())]
+        became = [row['diskID'] for row in rows if row['first'] and row['last']]
+        stopped = [row['diskID'] for row in rows if not row['first'] and not row['last']]
+        res = (version, became, stopped)
+    finally:
+        if conn is not None:
+            conn.close()
+        return res
+
+
+def rebuildReplicaCounts():
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        # log entries are taken from the rows actually deleted and inserted, see conflictsIncrement:
+        sqlClearDiskConflicts = sql.SQL("WITH Deleted AS (DELETE FROM DiskConflicts RETURNING diskID) "
+                                        "INSERT INTO ConflictLog(diskID, isConflicting) "
+                                        "SELECT diskID, FALSE FROM Deleted")
+        sqlClearQueryReplicas = sql.SQL("DELETE FROM QueryReplicas")
+        sqlFillQueryReplicas = sql.SQL("INSERT INTO QueryReplicas(queryID, disksNum) "
+                                       "SELECT queryID, COUNT(*) FROM QueryOnDisk GROUP BY queryID")
+        sqlFillDiskConflicts = sql.SQL("WITH Filled AS (INSERT INTO DiskConflicts(diskID, sharedQueries) "
+                                       "SELECT QD.diskID, COUNT(*) FROM QueryOnDisk QD, QueryReplicas QR "
+                                       "WHERE QD.queryID = QR.queryID AND QR.disksNum >= 2 "
+                                       "GROUP BY QD.diskID RETURNING diskID) "
+                                       "INSERT INTO ConflictLog(diskID, isConflicting) "
+                                       "SELECT diskID, TRUE FROM Filled")
+        transaction = createTransaction([sqlClearDiskConflicts, sqlClearQueryReplicas, sqlFillQueryReplicas,
+                                         sqlFillDiskConflicts])
+        conn.execute(transaction)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# PLACEMENT WORK-QUEUE: a worker claims a batch of unplaced queries, places them and completes them, or releases
+# them if it cannot. A claim expires after visibilityTimeout seconds, so the queries of a crashed worker are
+# claimed again. Claims skip rows other workers have locked, so concurrent workers never wait on or get the same
+# queries.
+
+# queues the queries that are on no disk and drops the unclaimed entries of queries placed since
+def enqueueUnplacedQueries() -> ReturnValue:
+    conn = None
+    retValue = None
+    try:
+        conn = Connector.DBConnector()
+        sqlDropPlaced = sql.SQL("DELETE FROM PlacementQueue PQ WHERE PQ.visibleAt <= now() "
+                                "AND EXISTS (SELECT 1 FROM QueryOnDisk QD WHERE QD.queryID = PQ.queryID)")
+        sqlEnqueue = sql.SQL("INSERT INTO PlacementQueue(queryID) "
+                             "SELECT Q.queryID FROM Queries Q "
+                             "WHERE NOT EXISTS (SELECT 1 FROM QueryOnDisk QD WHERE QD.queryID = Q.queryID) "
+                             "ON CONFLICT (queryID) DO NOTHING")
+        transaction = createTransaction([sqlDropPlaced, sqlEnqueue])
+        conn.execute(transaction)
+        retValue = ReturnValue.OK
+        conn.commit()
+    except Exception as e:
+        retValue = ReturnValue.ERROR
+        if conn is not None:
+            conn.rollback()
+    finally:
+        if conn is not None:
+            conn.close()
+        return retValue
+
+
+# claims up to batchSize queued queries for the worker, oldest first, and returns them ordered by queryID.
+# Queries placed since they were queued, by another worker whose claim expired or by addQueryToDisk, are
+# skipped and their entries dropped
+def claimUnplacedQueries(worker: str, batchSize: int, visibilityTimeout: float) -> List[Query]:
+    conn = None
+    res = []
+    try:
+        conn = Connector.DBConnector()
+        sqlDropPlaced = sql.SQL("DELETE FROM PlacementQueue WHERE queryID IN ("
+                                "SELECT PQ.queryID FROM PlacementQueue PQ WHERE PQ.visibleAt <= now() "
+                                "AND EXISTS (SELECT 1 FROM QueryOnDisk QD WHERE QD.queryID = PQ.queryID) "
+                                "LIMIT {batchSize} "
+                                "FOR UPDATE SKIP LOCKED)").format(batchSize=sql.Literal(batchSize))
+        conn.execute(sqlDropPlaced)
+        sqlQuery = sql.SQL("WITH Claimable AS ("
+                           "SELECT PQ.queryID FROM PlacementQueue PQ WHERE PQ.visibleAt <= now() "
+                           "AND NOT EXISTS (SELECT 1 FROM QueryOnDisk QD WHERE QD.queryID = PQ.queryID) "
+                           "ORDER BY PQ.visibleAt, PQ.queryID "
+                           "LIMIT {batchSize} "
+                           "FOR UPDATE SKIP LOCKED) "
+                           "UPDATE PlacementQueue PQ "
+                           "SET claimedBy = {worker}, visibleAt = now() + {timeout} * INTERVAL '1 second' "
+                           "FROM Claimable C, Queries Q, Purposes P "
+                           "WHERE PQ.queryID = C.queryID AND Q.queryID = PQ.queryID AND P.purposeID = Q.purposeID "
+                           "RETURNING Q.queryID, P.purpose, Q.querySize").format(
+            batchSize=sql.Literal(batchSize), worker=sql.Literal(worker), timeout=sql.Literal(visibilityTimeout))
+        rows_affected, result = conn.execute(sqlQuery)
+        conn.commit()
+        res = sorted((queryFromRow(result[i]) for i in range(result.size())), key=lambda query: query.getQueryID())
+    except Exception as e:
+        res = []
+        if conn is not None:
+            conn.rollback()
+    finally:
+        if conn is not None:
+            conn.close()
+        return res
+
+
+# hands the worker's claimed queries back to the queue, claims that expired or were taken over are left alone
+def releaseQueries(worker: str, queryIDs: List[int]) -> ReturnValue:
+    return updateClaims(sql.SQL("UPDATE PlacementQueue SET claimedBy = NULL, visibleAt = '-infinity' "), worker,
+                        queryIDs)
+
+
+# removes the worker's claimed queries from the queue once they are placed. A query that is placed is removed
+# even if its claim expired meanwhile, so that no other worker places it again
+def completeQueries(worker: str, queryIDs: List[int]) -> ReturnValue:
+    return updateClaims(sql.SQL("DELETE FROM PlacementQueue "), worker, queryIDs, orPlaced=True)
+
+
+# applies the statement to the worker's live claims of the queries, and with orPlaced also to the entries of the
+# queries that are placed
+def updateClaims(sqlStatement: sql.Composable, worker: str, queryIDs: List[int], orPlaced: bool = False) \
+        -> ReturnValue:
+    conn = None
+    retValue = None
+    try:
+        conn = Connector.DBConnector()
+        sqlPlaced = sql.SQL(" OR EXISTS (SELECT 1 FROM QueryOnDisk QD WHERE QD.queryID = PlacementQueue.queryID)") \
+            if orPlaced else sql.SQL("")
+        sqlQuery = sql.SQL("{statement}WHERE queryID = ANY({queryIDs}::INTEGER[]) "
+                           "AND ((claimedBy = {worker} AND visibleAt > now()){placed})").format(
+            statement=sqlStatement, queryIDs=sql.Literal(list(queryIDs)), worker=sql.Literal(worker),
+            placed=sqlPlaced)
+        conn.execute(sqlQuery)
+        retValue = ReturnValue.OK
+        conn.commit()
+    except Exception as e:
+        retValue = ReturnValue.ERROR
+        if conn is not None:
+            conn.rollback()
+    finally:
+        if conn is not None:
+            conn.close()
+        return retValue
+
+
 def mostAvailableDisks() -> List[int]:
     conn = None
     res = []
@@ -689,9 +1090,52 @@ def getCloseQueries(queryID: int) -> List[int]:
         return list
 
 
+# in-process caches of the Purposes and Companies dictionaries, one per database the connections can point at.
+# Codes are never reassigned while the tables exist:
+purposeCodes = {}
+companyCodes = {}
+
+
+def purposeCode(purpose: str, create: bool = True) -> Optional[int]:
+    return dictionaryCode(purposeCodes, "Purposes", "purposeID", "purpose", purpose, create)
+
+
+def companyCode(company: str, create: bool = True) -> Optional[int]:
+    return dictionaryCode(companyCodes, "Companies", "companyID", "company", company, create)
+
+
+# returns the code of the value, adding it to the dictionary if create is set, or None if it has no code.
+# New codes are committed on their own connection, so they stay valid even if the caller's transaction fails
+def dictionaryCode(caches: Dict[tuple, Dict[str, int]], table: str, codeColumn: str, valueColumn: str, value: str,
+                   create: bool) -> Optional[int]:
+    codes = caches.setdefault((Connector.DBConnector.section, Connector.DBConnector.database), {})
+    if value is None or value in codes:
+        return codes.get(value)
+    conn = None
+    try:
+        conn = Connector.DBConnector()
+        if create:
+            sqlQuery = sql.SQL("INSERT INTO {table}({valueColumn}) VALUES({value}) "
+                               "ON CONFLICT({valueColumn}) DO UPDATE SET {valueColumn} = EXCLUDED.{valueColumn} "
+                               "RETURNING {codeColumn}")
+        else:
+            sqlQuery = sql.SQL("SELECT {codeColumn} FROM {table} WHERE {valueColumn} = {value}")
+        rows_affected, result = conn.execute(sqlQuery.format(table=sql.Identifier(table.lower()),
+                                                             codeColumn=sql.Identifier(codeColumn.lower()),
+                                                             valueColumn=sql.Identifier(valueColumn.lower()),
+                                                             value=sql.Literal(value)))
+        conn.commit()
+        if not result.isEmpty():
+            codes[value] = result[0][codeColumn]
+    finally:
+        if conn is not None:
+            conn.close()
+    return codes.get(value)
+
+
 def queryFromResult(result: Connector.ResultSet) -> Query:
     if not result.isEmpty():
-        retQuery = Query(result[0]['queryID'], result[0]['purpose'], result[0]['querySize'])
+        retQuery = queryFromRow(result[0])
     else:
         retQuery = Query.badQuery()
     return retQuery
@@ -699,8 +1143,7 @@ def queryFromResult(result: Connector.ResultSet) -> Query:
 
 def diskFromResult(result: Connector.ResultSet) -> Disk:
     if not result.isEmpty():
-        retDisk = Disk(result[0]['diskID'], result[0]['diskCompany'], result[0]['speed'], result[0]['freeSpace'],
-                       result[0]['costPerByte'])
+        retDisk = diskFromRow(result[0])
     else:
         retDisk = Disk.badDisk()
     return retDisk
@@ -708,12 +1151,210 @@ def diskFromResult(result: Connector.ResultSet) -> Disk:
 
 def ramFromResult(result: Connector.ResultSet) -> RAM:
     if not result.isEmpty():
-        retQuery = RAM(result[0]['ramID'], result[0]['ramCompany'], result[0]['ramSize'])
+        retQuery = ramFromRow(result[0])
     else:
         retQuery = RAM.badRAM()
     return retQuery
 
 
+def queryFromRow(row: Connector.ResultSetDict) -> Query:
+    return Query(row['queryID'], row['purpose'], row['querySize'])
+
+
+def diskFromRow(row: Connector.ResultSetDict) -> Disk:
+    return Disk(row['diskID'], row['diskCompany'], row['speed'], row['freeSpace'], row['costPerByte'])
+
+
+def ramFromRow(row: Connector.ResultSetDict) -> RAM:
+    return RAM(row['ramID'], row['ramCompany'], row['ramSize'])
+
+
+def createPlacementTablesSql(partitions: int) -> List[sql.Composed]:
+    partitionBy = sql.SQL(" PARTITION BY HASH(diskID)" if partitions > 0 else "")
+    sqlCreateQueryOnDisk = sql.SQL("CREATE TABLE QueryOnDisk("
+                                   "queryID INTEGER,"
+                                   "diskID INTEGER,"
+                                   "PRIMARY KEY(queryID, diskID),"
+                                   "FOREIGN KEY(queryID) REFERENCES Queries(queryID) ON DELETE CASCADE,"
+                                   "FOREIGN KEY(diskID) REFERENCES Disks(diskID) ON DELETE CASCADE)"
+                                   "{partitionBy}").format(partitionBy=partitionBy)
+
+    sqlCreateRAMOnDisk = sql.SQL("CREATE TABLE RAMOnDisk("
+                                 "ramID INTEGER,"
+                                 "diskID INTEGER,"
+                                 "PRIMARY KEY(ramID, diskID),"
+                                 "FOREIGN KEY(ramID) REFERENCES RAMs(ramID) ON DELETE CASCADE,"
+                                 "FOREIGN KEY(diskID) REFERENCES Disks(diskID) ON DELETE CASCADE)"
+                                 "{partitionBy}").format(partitionBy=partitionBy)
+
+    sqlCreateQueryOnDiskIndex = sql.SQL("CREATE INDEX QueryOnDiskDiskIndex ON QueryOnDisk(diskID)")
+
+    sqlCreatePartitions = [sql.SQL("CREATE TABLE {partition} PARTITION OF {table} "
+                                   "FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})")
+                           .format(partition=sql.Identifier(table.lower() + "_" + str(remainder)),
+                                   table=sql.Identifier(table.lower()), modulus=sql.Literal(partitions),
+                                   remainder=sql.Literal(remainder))
+                           for table in ["QueryOnDisk", "RAMOnDisk"] for remainder in range(partitions)]
+    return [sqlCreateQueryOnDisk, sqlCreateRAMOnDisk] + sqlCreatePartitions + [sqlCreateQueryOnDiskIndex]
+
+
+def createViewsSql() -> List[sql.Composed]:
+    sqlCreateRunningQueriesView = sql.SQL("CREATE VIEW RunningQueries AS "
+                                          "SELECT Q.queryID, querySize, purposeID, D.diskID, costPerByte "
+                                          "FROM Queries Q, QueryOnDisk QD, Disks D "
+                                          "WHERE Q.queryID = QD.queryID AND QD.diskID = D.diskID")
+
+    sqlCreateRunningRAMsView = sql.SQL("CREATE VIEW RunningRAMs AS "
+                                       "SELECT R.ramID, R.ramCompanyID, D.diskID, D.diskCompanyID "
+                                       "FROM Rams R, RAMOnDisk RD, Disks D "
+                                       "WHERE R.ramID = RD.ramID AND RD.diskID = D.diskID")
+
+    sqlRunableQueriesView = sql.SQL("CREATE VIEW RunableQueries AS "
+                                    "SELECT D.diskID, Q.queryID, Q.querySize "
+                                    "FROM Queries Q, Disks D "
+                                    "WHERE Q.querySize <= D.freeSpace ")
+
+    sqlTotalRAMView = sql.SQL("CREATE VIEW TotalRAM AS "
+                              "SELECT D.diskID, (SELECT COALESCE(SUM(R.ramSize), 0) FROM RAMOnDisk RD, RAMs R WHERE R.ramID = RD.ramID AND RD.diskID = D.diskID) AS totalRAM "
+                              "FROM Disks D ")
+
+    sqlMutualDisksView = sql.SQL("CREATE VIEW MutualDisks AS "
+                                 "SELECT Q1.queryID AS queryID1, Q2.queryID AS queryID2, (SELECT COUNT(*) FROM QueryOnDisk QD1, QueryOnDisk QD2 "
+                                 "WHERE QD1.queryID = Q1.queryID AND QD2.queryID = Q2.queryID AND QD1.diskID = QD2.diskID) AS disksNum "
+                                 "FROM Queries Q1, Queries Q2")
+
+    return [sqlCreateRunningQueriesView, sqlCreateRunningRAMsView, sqlRunableQueriesView, sqlTotalRAMView,
+            sqlMutualDisksView]
+
+
+def addQueryToDiskSql(queryID: int, querySize: int, diskID: int) -> List[sql.Composed]:
+    sqlUpdateQuery = sql.SQL("UPDATE Disks SET freeSpace = freeSpace - {querySize}"
+                             " WHERE diskID={diskID}") \
+        .format(diskID=sql.Literal(diskID), querySize=sql.Literal(querySize))
+
+    sqlInsertQuery = sql.SQL("INSERT INTO QueryOnDisk(queryID, diskID) VALUES("
+                             "{queryID}, {diskID})").format(queryID=sql.Literal(queryID),
+                                                            diskID=sql.Literal(diskID))
+
+    return [sqlInsertQuery, sqlUpdateQuery] + conflictsOnPlacementAdded(queryID, diskID)
+
+
+def removeQueryFromDiskSql(queryID: int, querySize: int, diskID: int) -> List[sql.Composed]:
+    sqlUpdateQuery = sql.SQL("UPDATE Disks SET freeSpace = freeSpace + {querySize} WHERE diskID IN "
+                             "(SELECT diskID FROM QueryOnDisk WHERE diskID={diskID} AND queryID={queryID})") \
+        .format(diskID=sql.Literal(diskID), queryID=sql.Literal(queryID), querySize=sql.Literal(querySize))
+
+    sqlDeleteQuery = sql.SQL("DELETE FROM QueryOnDisk WHERE queryID = {queryID} AND diskID = {diskID}") \
+        .format(queryID=sql.Literal(queryID), diskID=sql.Literal(diskID))
+
+    # the replica row is locked first, so the free space and counters are read after any concurrent change:
+    return lockReplicasSql(sql.Literal([queryID])) + [sqlUpdateQuery] + \
+        conflictsOnPlacementRemoved(queryID, diskID) + [sqlDeleteQuery]
+
+
+def addRAMToDiskSql(ramID: int, diskID: int) -> List[sql.Composed]:
+    sqlInsertRAM = sql.SQL("INSERT INTO RAMOnDisk(ramID, diskID) VALUES("
+                           "{ramID}, {diskID})").format(ramID=sql.Literal(ramID),
+                                                        diskID=sql.Literal(diskID))
+    return [sqlInsertRAM]
+
+
+def removeRAMFromDiskSql(ramID: int, diskID: int) -> List[sql.Composed]:
+    sqlDeleteQuery = sql.SQL("DELETE FROM RAMOnDisk WHERE ramID = {ramID} AND diskID = {diskID}") \
+        .format(ramID=sql.Literal(ramID), diskID=sql.Literal(diskID))
+    return [sqlDeleteQuery]
+
+
+def conflictsOnPlacementAdded(queryID: int, diskID: int) -> List[sql.Composed]:
+    # runs after the placement is inserted. A query that reaches its 2nd disk makes both disks share it,
+    # a query that reaches its 3rd or later disk only adds the new one:
+    sqlUpdateReplicas = sql.SQL("INSERT INTO QueryReplicas(queryID, disksNum) VALUES({queryID}, 1) "
+                                "ON CONFLICT(queryID) DO UPDATE SET disksNum = QueryReplicas.disksNum + 1") \
+        .format(queryID=sql.Literal(queryID))
+    sharedDisks = sql.SQL("SELECT QD.diskID FROM QueryOnDisk QD, QueryReplicas QR "
+                          "WHERE QD.queryID = {queryID} AND QR.queryID = QD.queryID AND QR.disksNum >= 2 "
+                          "AND (QR.disksNum = 2 OR QD.diskID = {diskID})") \
+        .format(queryID=sql.Literal(queryID), diskID=sql.Literal(diskID))
+    return [sqlUpdateReplicas] + conflictsIncrement(sharedDisks)
+
+
+def conflictsOnPlacementRemoved(queryID: int, diskID: int) -> List[sql.Composed]:
+    # runs before the placement is deleted, and is a no-op if the placement does not exist. The caller must hold
+    # the lock of lockReplicasSql, or two removes could both derive the shared disks from the same disksNum:
+    sharedDisks = sql.SQL("SELECT QD.diskID FROM QueryOnDisk QD, QueryReplicas QR "
+                          "WHERE QD.queryID = {queryID} AND QR.queryID = QD.queryID AND QR.disksNum >= 2 "
+                          "AND (QR.disksNum = 2 OR QD.diskID = {diskID}) "
+                          "AND EXISTS (SELECT 1 FROM QueryOnDisk WHERE queryID = {queryID} AND diskID = {diskID})") \
+        .format(queryID=sql.Literal(queryID), diskID=sql.Literal(diskID))
+    sqlUpdateReplicas = sql.SQL("UPDATE QueryReplicas SET disksNum = disksNum - 1 "
+                                "WHERE queryID = {queryID} AND EXISTS "
+                                "(SELECT 1 FROM QueryOnDisk WHERE queryID = {queryID} AND diskID = {diskID})") \
+        .format(queryID=sql.Literal(queryID), diskID=sql.Literal(diskID))
+    sqlDeleteReplicas = sql.SQL("DELETE FROM QueryReplicas WHERE queryID = {queryID} AND disksNum = 0") \
+        .format(queryID=sql.Literal(queryID))
+    return conflictsDecrement(sharedDisks) + [sqlUpdateReplicas, sqlDeleteReplicas]
+
+
+def conflictsOnQueryDeleted(queryID: int) -> List[sql.Composed]:
+    # runs before the query is deleted, its QueryReplicas row goes with it. The caller must hold the lock of
+    # lockReplicasSql:
+    sharedDisks = sql.SQL("SELECT QD.diskID FROM QueryOnDisk QD, QueryReplicas QR "
+                          "WHERE QD.queryID = {queryID} AND QR.queryID = QD.queryID AND QR.disksNum >= 2") \
+        .format(queryID=sql.Literal(queryID))
+    return conflictsDecrement(sharedDisks)
+
+
+def conflictsOnDiskDeleted(diskID: int) -> List[sql.Composed]:
+    # runs before the disk is deleted. Its own DiskConflicts row goes with it, and the only other disks
+    # affected are the last partners of its queries that are on exactly 2 disks:
+    sqlLock = lockReplicasSql(sql.SQL("ARRAY(SELECT queryID FROM QueryOnDisk WHERE diskID = {diskID})")
+                              .format(diskID=sql.Literal(diskID)))
+    sqlLogDisk = sql.SQL("WITH Deleted AS (DELETE FROM DiskConflicts WHERE diskID = {diskID} RETURNING diskID) "
+                         "INSERT INTO ConflictLog(diskID, isConflicting) SELECT diskID, FALSE FROM Deleted") \
+        .format(diskID=sql.Literal(diskID))
+    sharedDisks = sql.SQL("SELECT QD2.diskID FROM QueryOnDisk QD1, QueryReplicas QR, QueryOnDisk QD2 "
+                          "WHERE QD1.diskID = {diskID} AND QR.queryID = QD1.queryID AND QR.disksNum = 2 "
+                          "AND QD2.queryID = QD1.queryID AND QD2.diskID <> QD1.diskID") \
+        .format(diskID=sql.Literal(diskID))
+    sqlUpdateReplicas = sql.SQL("UPDATE QueryReplicas SET disksNum = disksNum - 1 "
+                                "WHERE queryID IN (SELECT queryID FROM QueryOnDisk WHERE diskID = {diskID})") \
+        .format(diskID=sql.Literal(diskID))
+    sqlDeleteReplicas = sql.SQL("DELETE FROM QueryReplicas WHERE disksNum = 0")
+    return sqlLock + [sqlLogDisk] + conflictsDecrement(sharedDisks) + [sqlUpdateReplicas, sqlDeleteReplicas]
+
+
+# locks the QueryReplicas rows of the queries, in queryID order so that concurrent lockers cannot deadlock.
+# The statements after it see every change committed while it waited
+def lockReplicasSql(queryIDs: sql.Composable) -> List[sql.Composed]:
+    return [sql.SQL("SELECT queryID FROM QueryReplicas WHERE queryID = ANY({queryIDs}::INTEGER[]) "
+                    "ORDER BY queryID FOR UPDATE").format(queryIDs=queryIDs)]
+
+
+# the log entries are taken from the rows the upsert inserted and the delete removed, which are decided under
+# the rows' locks, so concurrent changes to the same disk log its transitions in the order they commit.
+# Rows are locked in diskID order so that concurrent changes to several disks cannot deadlock
+def conflictsIncrement(sharedDisks: sql.Composable) -> List[sql.Composed]:
+    sqlUpsert = sql.SQL("WITH Upserted AS (INSERT INTO DiskConflicts(diskID, sharedQueries) "
+                        "SELECT S.diskID, COUNT(*) FROM ({sharedDisks}) S GROUP BY S.diskID ORDER BY S.diskID "
+                        "ON CONFLICT(diskID) DO UPDATE SET sharedQueries = "
+                        "DiskConflicts.sharedQueries + EXCLUDED.sharedQueries "
+                        "RETURNING diskID, (xmax = 0) AS inserted) "
+                        "INSERT INTO ConflictLog(diskID, isConflicting) "
+                        "SELECT diskID, TRUE FROM Upserted WHERE inserted").format(sharedDisks=sharedDisks)
+    return [sqlUpsert]
+
+
+def conflictsDecrement(sharedDisks: sql.Composable) -> List[sql.Composed]:
+    sqlLock = sql.SQL("SELECT diskID FROM DiskConflicts WHERE diskID IN (SELECT diskID FROM ({sharedDisks}) S) "
+                      "ORDER BY diskID FOR UPDATE").format(sharedDisks=sharedDisks)
+    sqlUpdate = sql.SQL("UPDATE DiskConflicts DC SET sharedQueries = DC.sharedQueries - S.num "
+                        "FROM (SELECT diskID, COUNT(*) AS num FROM ({sharedDisks}) S0 GROUP BY diskID) S "
+                        "WHERE DC.diskID = S.diskID").format(sharedDisks=sharedDisks)
+    sqlDelete = sql.SQL("WITH Deleted AS (DELETE FROM DiskConflicts WHERE sharedQueries = 0 RETURNING diskID) "
+                        "INSERT INTO ConflictLog(diskID, isConflicting) SELECT diskID, FALSE FROM Deleted")
+    return [sqlLock, sqlUpdate, sqlDelete]
+
+
 def createTransaction(sqlList):
     sqlList.insert(0, sql.SQL("BEGIN"))
     sqlList.append(sql.SQL("COMMIT"))
@@ -0,0 +1,106 @@
+import threading
+import unittest
+import Solution
+import Utility.DBConnector as Connector
+from Utility.ReturnValue import ReturnValue
+from Business.Query import Query
+from Business.Disk import Disk
+from psycopg2 import sql
+
+
+# DiskConflicts must always hold what the self-join over QueryOnDisk that getConflictingDisks used to run gives.
+# Needs the database of Utility/database.ini
+class TestConflictCounters(unittest.TestCase):
+    def setUp(self):
+        Solution.dropTables()
+        Solution.createTables()
+        for diskID in range(1, 5):
+            self.assertEqual(Solution.addDisk(Disk(diskID, "DELL", 10, 1000, 1)), ReturnValue.OK)
+        self.queries = [Query(queryID, "test", 10) for queryID in range(1, 7)]
+        for query in self.queries:
+            self.assertEqual(Solution.addQuery(query), ReturnValue.OK)
+
+    def tearDown(self):
+        Solution.dropTables()
+
+    def assertCountersMatchSelfJoin(self):
+        conn = None
+        try:
+            conn = Connector.DBConnector()
+            rows_affected, expected = conn.execute(sql.SQL(
+                "SELECT QD1.diskID, COUNT(DISTINCT QD1.queryID) FROM QueryOnDisk QD1, QueryOnDisk QD2 "
+                "WHERE QD1.queryID = QD2.queryID AND QD1.diskID <> QD2.diskID GROUP BY QD1.diskID"))
+            rows_affected, counters = conn.execute(sql.SQL("SELECT diskID, sharedQueries FROM DiskConflicts"))
+            rows_affected, log = conn.execute(sql.SQL("SELECT diskID, isConflicting FROM ConflictLog ORDER BY version"))
+            conn.commit()
+        finally:
+            if conn is not None:
+                conn.close()
+        expected = {row[0]: row[1] for row in expected.rows}
+        self.assertEqual({row[0]: row[1] for row in counters.rows}, expected)
+        self.assertEqual(Solution.getConflictingDisks(), sorted(expected))
+        # every disk's log entries alternate, and the last one tells whether it is conflicting now:
+        states = {}
+        for diskID, isConflicting in log.rows:
+            self.assertNotEqual(states.get(diskID, False), isConflicting)
+            states[diskID] = isConflicting
+        self.assertEqual(sorted(diskID for diskID, isConflicting in states.items() if isConflicting), sorted(expected))
+        version, became, stopped = Solution.getConflictingDisksChanges(0)
+        self.assertEqual(sorted(became), sorted(expected))
+        self.assertEqual(stopped, [])
+
+    def runConcurrently(self, *calls):
+        barrier = threading.Barrier(len(calls))
+
+        def run(call):
+            barrier.wait()
+            call()
+
+        threads = [threading.Thread(target=run, args=(call,)) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_sequentialChanges(self):
+        placements = [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (3, 3), (3, 4), (4, 4), (5, 1), (5, 4)]
+        for queryID, diskID in placements:
+            self.assertEqual(Solution.addQueryToDisk(self.queries[queryID - 1], diskID), ReturnValue.OK)
+            self.assertCountersMatchSelfJoin()
+        for queryID, diskID in [(1, 2), (1, 2), (3, 4), (6, 1)]:
+            Solution.removeQueryFromDisk(self.queries[queryID - 1], diskID)
+            self.assertCountersMatchSelfJoin()
+        self.assertEqual(Solution.deleteQuery(self.queries[1]), ReturnValue.OK)
+        self.assertCountersMatchSelfJoin()
+        self.assertEqual(Solution.deleteDisk(4), ReturnValue.OK)
+        self.assertCountersMatchSelfJoin()
+
+    def test_concurrentRemoves(self):
+        # query 1 moves on and off disks 1 and 2 while query 2 keeps them conflicting:
+        for diskID in [1, 2]:
+            Solution.addQueryToDisk(self.queries[1], diskID)
+        for _ in range(20):
+            for diskID in [1, 2, 3]:
+                Solution.addQueryToDisk(self.queries[0], diskID)
+            # two removes of different placements and two of the same one:
+            self.runConcurrently(*[lambda diskID=diskID: Solution.removeQueryFromDisk(self.queries[0], diskID)
+                                   for diskID in [1, 2, 3, 3]])
+            self.assertCountersMatchSelfJoin()
+            self.assertEqual(Solution.getDiskProfile(3).getFreeSpace(), 1000)
+
+    def test_concurrentAddAndRemove(self):
+        # disk 1 stops conflicting through query 1 as it starts conflicting through query 2, and back:
+        Solution.addQueryToDisk(self.queries[1], 3)
+        for _ in range(20):
+            for diskID in [1, 2]:
+                Solution.addQueryToDisk(self.queries[0], diskID)
+            self.runConcurrently(lambda: Solution.removeQueryFromDisk(self.queries[0], 2),
+                                 lambda: Solution.addQueryToDisk(self.queries[1], 1))
+            self.assertCountersMatchSelfJoin()
+            self.runConcurrently(lambda: Solution.removeQueryFromDisk(self.queries[0], 1),
+                                 lambda: Solution.removeQueryFromDisk(self.queries[1], 1))
+            self.assertCountersMatchSelfJoin()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+import argparse
+import decimal
+import functools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterator
+import Solution
+import Utility.DBConnector as Connector
+from Utility.ReturnValue import ReturnValue
+from Business.Query import Query
+from Business.RAM import RAM
+from Business.Disk import Disk
+
+# Trace recording and replay of the Solution functions.
+# TraceRecorder(path).install() wraps the Solution functions so that every call is appended to a JSONL trace as
+# {"t": start offset in seconds, "f": function, "a": arguments, "d": duration in seconds, "r": result}, plus
+# "k": keyword arguments for calls that pass any.
+# replay() plays a trace back at its original rate, at speed times its rate, or flat out, on a pool of workers,
+# and reports throughput, latency percentiles and the calls whose result differs from the recorded one.
+# Usage: python TraceReplay.py trace.jsonl [--speed 2 | --flat-out] [--workers 8] [--section replay]
+
+TRACED_FUNCTIONS = ["addQuery", "getQueryProfile", "getQueryProfiles", "deleteQuery", "addDisk", "getDiskProfile",
+                    "getDiskProfiles", "deleteDisk", "addRAM", "getRAMProfile", "getRAMProfiles", "deleteRAM",
+                    "addDiskAndQuery", "addQueryToDisk", "removeQueryFromDisk", "addRAMToDisk", "removeRAMFromDisk",
+                    "averageSizeQueriesOnDisk", "diskTotalRAM", "getCostForPurpose", "getQueriesCanBeAddedToDisk",
+                    "getQueriesCanBeAddedToDiskAndRAM", "isCompanyExclusive", "getCompanyExclusivity",
+                    "getConflictingDisks", "getConflictingDisksChanges", "mostAvailableDisks", "getCloseQueries",
+                    "getDiskDashboard", "enqueueUnplacedQueries", "claimUnplacedQueries", "releaseQueries",
+                    "completeQueries"]
+
+
+def encode(value):
+    if isinstance(value, Query):
+        return {"Query": [value.getQueryID(), value.getPurpose(), value.getSize()]}
+    if isinstance(value, Disk):
+        return {"Disk": [value.getDiskID(), value.getCompany(), value.getSpeed(), value.getFreeSpace(),
+                         value.getCost()]}
+    if isinstance(value, RAM):
+        return {"RAM": [value.getRamID(), value.getCompany(), value.getSize()]}
+    if isinstance(value, ReturnValue):
+        return {"ReturnValue": value.name}
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, dict):
+        return {"dict": [[encode(key), encode(item)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "Query" in value:
+        return Query(*value["Query"])
+    if "Disk" in value:
+        return Disk(*value["Disk"])
+    if "RAM" in value:
+        return RAM(*value["RAM"])
+    if "ReturnValue" in value:
+        return ReturnValue[value["ReturnValue"]]
+    return {decode(key): decode(item) for key, item in value["dict"]}
+
+
+class TraceRecorder:
+    def __init__(self, path: str):
+        self.__path = path
+        self.__file = None
+        self.__lock = threading.Lock()
+        self.__start = None
+        self.__originals = {}
+
+    def install(self):
+        self.__file = open(self.__path, "a")
+        self.__start = time.monotonic()
+        for name in TRACED_FUNCTIONS:
+            self.__originals[name] = getattr(Solution, name)
+            setattr(Solution, name, self.__wrap(name, self.__originals[name]))
+
+    def uninstall(self):
+        for name, function in self.__originals.items():
+            setattr(Solution, name, function)
+        self.__originals = {}
+        with self.__lock:
+            self.__file.close()
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+
+    def __wrap(self, name, function):
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            start = time.monotonic()
+            result = function(*args, **kwargs)
+            # generators, and the iterators AdmissionControl wraps them in, are drained so that their rows can be
+            # recorded:
+            isGenerator = isinstance(result, Iterator)
+            if isGenerator:
+                result = list(result)
+            duration = time.monotonic() - start
+            record = {"t": round(start - self.__start, 6), "f": name, "a": encode(list(args)),
+                      "d": round(duration, 6), "r": encode(result)}
+            if kwargs:
+                record["k"] = encode(kwargs)
+            record = json.dumps(record, separators=(",", ":"))
+            with self.__lock:
+                self.__file.write(record + "\n")
+            return iter(result) if isGenerator else result
+        return traced
+
+
+def readTrace(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# speed None replays flat out, otherwise every call starts at its recorded offset divided by speed. Latencies are
+# measured from when a call was due, so the time it waits for a free worker is included
+def replay(trace: List[Dict], speed: Optional[float] = 1.0, workers: int = 8) -> Dict[str, object]:
+    latencies = []
+    divergences = []
+    lock = threading.Lock()
+
+    def call(record, scheduled):
+        function = getattr(Solution, record["f"])
+        try:
+            result = function(*decode(record["a"]), **decode(record.get("k", {"dict": []})))
+            if isinstance(result, Iterator):
+                result = list(result)
+            replayed = encode(result)
+        except Exception as e:
+            replayed = "exception: " + str(e)
+        latency = time.monotonic() - scheduled
+        with lock:
+            latencies.append(latency)
+            if replayed != record["r"]:
+                divergences.append({"f": record["f"], "a": record["a"], "recorded": record["r"],
+                                    "replayed": replayed})
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(workers) as pool:
+        # records are written as calls finish, so they are replayed in the order the calls started:
+        for record in sorted(trace, key=lambda record: record["t"]):
+            if speed is None:
+                scheduled = time.monotonic()
+            else:
+                scheduled = start + record["t"] / speed
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(call, record, scheduled)
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    return {"calls": len(latencies), "seconds": elapsed,
+            "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "p50": percentile(latencies, 50), "p90": percentile(latencies, 90), "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0, "divergences": divergences}
+
+
+def percentile(sortedValues: List[float], percent: float) -> float:
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percent / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a trace of Solution calls against a database.")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=1.0, help="multiple of the recorded rate")
+    parser.add_argument("--flat-out", action="store_true", help="ignore the recorded timing")
+    parser.add_argument("--workers", type=int, default=8, help="number of concurrent callers")
+    parser.add_argument("--section", default=Connector.DBConnector.section,
+                        help="section of database.ini of the target database")
+    args = parser.parse_args()
+
+    Connector.DBConnector.section = args.section
+    report = replay(readTrace(args.trace), None if args.flat_out else args.speed, args.workers)
+    print("calls: " + str(report["calls"]) + " in " + "%.3f" % report["seconds"] + "s, " +
+          "%.1f" % report["throughput"] + " calls/s")
+    print("latency ms: p50 " + "%.2f" % (report["p50"] * 1000) + ", p90 " + "%.2f" % (report["p90"] * 1000) +
+          ", p99 " + "%.2f" % (report["p99"] * 1000) + ", max " + "%.2f" % (report["max"] * 1000))
+    print("divergences: " + str(len(report["divergences"])))
+    for divergence in report["divergences"][:20]:
+        print("  " + json.dumps(divergence))
+
+
+if __name__ == "__main__":
+    main()
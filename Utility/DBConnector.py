@@ -65,13 +65,20 @@ class ResultSet:
 
 
 class DBConnector:
+    # section of database.ini every new connection uses
+    section = 'postgresql'
+    # when set, every new connection uses this database instead of the one in database.ini
+    database = None
+
     # constructor
-    def __init__(self):
+    def __init__(self, autocommit=False):
         try:
             # Obtain the configuration parameters
-            params = DBConnector.__config()
+            params = DBConnector.__config(section=DBConnector.section)
+            if DBConnector.database is not None:
+                params['database'] = DBConnector.database
             self.connection = psycopg2.connect(**params)
-            self.connection.autocommit = False
+            self.connection.autocommit = autocommit
             self.cursor = self.connection.cursor()
         except Exception as e:
             self.connection = None
@@ -132,6 +139,38 @@ class DBConnector:
 
         return row_effected, entries
 
+    # executes the query on a server side cursor and yields its rows one by one as ResultSetDicts
+    # rows are fetched batchSize at a time, so large results are never held in memory at once
+    def stream(self, query: Union[str, sql.Composed], batchSize=1000):
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+
+        cursor = self.connection.cursor(name="stream")
+        cursor.itersize = batchSize
+        try:
+            cursor.execute(query)
+            header = None
+            for row in cursor:
+                if header is None:
+                    header = [d.name for d in cursor.description]
+                yield ResultSetDict(zip(header, row))
+        finally:
+            cursor.close()
+
+    # copies the rows of file into the table using a COPY ... FROM STDIN query
+    # returns the number of rows copied
+    def copy(self, query: Union[str, sql.Composed], file) -> int:
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+
+        try:
+            self.cursor.copy_expert(query, file)
+        except errors.lookup("23502"):
+            raise DatabaseException.NOT_NULL_VIOLATION("NOT_NULL_VIOLATION")
+        except errors.lookup("23514"):
+            raise DatabaseException.CHECK_VIOLATION("CHECK_VIOLATION")
+        return max(self.cursor.rowcount, 0)
+
     # grant credentials
     @staticmethod
     def __config(filename=os.path.join(os.path.join(os.getcwd(), "Utility"), 'database.ini'),
@@ -150,7 +189,8 @@ class DBConnector:
         else:
             # file not found
             db = DBConnector.__config(
-                filename=os.path.join(os.path.join(os.path.dirname(os.getcwd()), 'Utility'), 'database.ini'))
+                filename=os.path.join(os.path.join(os.path.dirname(os.getcwd()), 'Utility'), 'database.ini'),
+                section=section)
             if db is None:
                 raise DatabaseException.database_ini_ERROR("Please modify database.ini file under Utility")
         return db
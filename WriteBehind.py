@@ -0,0 +1,216 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+import Utility.DBConnector as Connector
+from Utility.ReturnValue import ReturnValue
+from Utility.Exceptions import DatabaseException
+from Business.Query import Query
+from psycopg2 import sql
+from Solution import addQueryToDiskSql, removeQueryFromDiskSql, addRAMToDiskSql, removeRAMFromDiskSql
+
+
+class PendingOperation:
+    def __init__(self, kind: str, isAdd: bool, entityID: int, diskID: int, size: int = None):
+        self.kind = kind
+        self.isAdd = isAdd
+        self.entityID = entityID
+        self.diskID = diskID
+        self.size = size
+        self.future = Future()
+        # the remove that follows this add on the same pair, or the add that precedes this remove:
+        self.partner = None
+        # for a query add, the number of query adds to its disk queued up to and including it:
+        self.diskAdds = None
+
+    def statements(self) -> List[sql.Composed]:
+        if self.kind == "query":
+            if self.isAdd:
+                return addQueryToDiskSql(self.entityID, self.size, self.diskID)
+            return removeQueryFromDiskSql(self.entityID, self.size, self.diskID)
+        if self.isAdd:
+            return addRAMToDiskSql(self.entityID, self.diskID)
+        return removeRAMFromDiskSql(self.entityID, self.diskID)
+
+
+# Opt-in write-behind mode for addQueryToDisk/removeQueryFromDisk/addRAMToDisk/removeRAMFromDisk.
+# Calls are queued and return a Future of the ReturnValue the Solution function would return. A background
+# thread writes the queue as one transaction once it holds maxItems operations or its oldest operation is
+# maxDelayMs old. An add followed by a remove of the same pair cancels out when the add would have succeeded.
+# A query pair only cancels if no other query add to the same disk is queued between the two, since that add
+# could fail for want of the space the cancelled placement would have held.
+class WriteBehindBuffer:
+    def __init__(self, maxItems: int = 100, maxDelayMs: int = 50):
+        self.__maxItems = maxItems
+        self.__maxDelay = maxDelayMs / 1000
+        self.__pending = []
+        self.__lastAdds = {}
+        self.__diskAdds = {}
+        self.__oldest = None
+        self.__closed = False
+        self.__flushRequested = False
+        self.__condition = threading.Condition()
+        # only this thread writes, so batches are written one at a time and in order:
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def addQueryToDisk(self, query: Query, diskID: int) -> Future:
+        return self.__enqueue(PendingOperation("query", True, query.getQueryID(), diskID, query.getSize()))
+
+    def removeQueryFromDisk(self, query: Query, diskID: int) -> Future:
+        return self.__enqueue(PendingOperation("query", False, query.getQueryID(), diskID, query.getSize()))
+
+    def addRAMToDisk(self, ramID: int, diskID: int) -> Future:
+        return self.__enqueue(PendingOperation("ram", True, ramID, diskID))
+
+    def removeRAMFromDisk(self, ramID: int, diskID: int) -> Future:
+        return self.__enqueue(PendingOperation("ram", False, ramID, diskID))
+
+    # waits until everything queued so far is written
+    def flush(self):
+        with self.__condition:
+            operations = list(self.__pending)
+            self.__flushRequested = True
+            self.__condition.notify()
+        for operation in operations:
+            operation.future.result()
+
+    # writes what is still queued and stops the background thread
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.__thread.join()
+
+    def __enqueue(self, operation: PendingOperation) -> Future:
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError("write-behind buffer is closed")
+            pair = (operation.kind, operation.entityID, operation.diskID)
+            if operation.isAdd:
+                self.__lastAdds[pair] = operation
+                if operation.kind == "query":
+                    self.__diskAdds[operation.diskID] = self.__diskAdds.get(operation.diskID, 0) + 1
+                    operation.diskAdds = self.__diskAdds[operation.diskID]
+            else:
+                add = self.__lastAdds.pop(pair, None)
+                if add is not None and (add.kind != "query" or add.diskAdds == self.__diskAdds[add.diskID]):
+                    add.partner = operation
+                    operation.partner = add
+            self.__pending.append(operation)
+            if self.__oldest is None:
+                self.__oldest = time.monotonic()
+            self.__condition.notify()
+        return operation.future
+
+    def __take(self) -> List[PendingOperation]:
+        operations = self.__pending
+        self.__pending = []
+        self.__lastAdds = {}
+        self.__diskAdds = {}
+        self.__oldest = None
+        self.__flushRequested = False
+        return operations
+
+    def __run(self):
+        closed = False
+        while not closed:
+            with self.__condition:
+                while not self.__closed and not self.__isDue():
+                    timeout = None if self.__oldest is None else self.__oldest + self.__maxDelay - time.monotonic()
+                    self.__condition.wait(timeout)
+                closed = self.__closed
+                operations = self.__take()
+            # the thread must outlive any failure, or every later future would never resolve:
+            try:
+                self.__write(operations)
+            except Exception:
+                for operation in operations:
+                    if not operation.future.done():
+                        operation.future.set_result(ReturnValue.ERROR)
+
+    def __isDue(self) -> bool:
+        return self.__flushRequested or len(self.__pending) >= self.__maxItems or \
+            (self.__oldest is not None and time.monotonic() - self.__oldest >= self.__maxDelay)
+
+    def __write(self, operations: List[PendingOperation]):
+        if not operations:
+            return
+        conn = None
+        results = {}
+        try:
+            conn = Connector.DBConnector()
+            for operation in operations:
+                if operation in results:
+                    continue
+                if operation.isAdd and operation.partner is not None and self.__wouldSucceed(conn, operation):
+                    results[operation] = ReturnValue.OK
+                    results[operation.partner] = ReturnValue.OK
+                else:
+                    results[operation] = self.__apply(conn, operation)
+            conn.commit()
+        except Exception as e:
+            results = {operation: ReturnValue.ERROR for operation in operations}
+            # the connection may be dead, in which case there is nothing to roll back:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            for operation in operations:
+                operation.future.set_result(results[operation])
+
+    # the ReturnValue of every operation is the one its Solution function would return
+    @staticmethod
+    def __apply(conn: Connector.DBConnector, operation: PendingOperation) -> ReturnValue:
+        conn.execute(sql.SQL("SAVEPOINT operation"))
+        failed = True
+        try:
+            rows_affected, _ = conn.execute(sql.SQL('; ').join(operation.statements()))
+            retValue = ReturnValue.OK
+            if operation.kind == "ram" and not operation.isAdd and rows_affected == 0:
+                retValue = ReturnValue.NOT_EXISTS
+            failed = False
+        except DatabaseException.FOREIGN_KEY_VIOLATION:
+            retValue = ReturnValue.NOT_EXISTS if operation.isAdd else ReturnValue.OK
+        except DatabaseException.UNIQUE_VIOLATION:
+            retValue = ReturnValue.ALREADY_EXISTS if operation.isAdd else ReturnValue.ERROR
+        except DatabaseException.CHECK_VIOLATION:
+            retValue = ReturnValue.BAD_PARAMS if operation.isAdd else ReturnValue.ERROR
+        except Exception:
+            retValue = ReturnValue.ERROR
+        if failed:
+            conn.execute(sql.SQL("ROLLBACK TO SAVEPOINT operation"))
+        else:
+            conn.execute(sql.SQL("RELEASE SAVEPOINT operation"))
+        return retValue
+
+    # whether the add would succeed right now, in which case it and the remove after it change nothing
+    @staticmethod
+    def __wouldSucceed(conn: Connector.DBConnector, operation: PendingOperation) -> bool:
+        if operation.kind == "query":
+            sqlQuery = sql.SQL("SELECT EXISTS (SELECT 1 FROM Queries WHERE queryID = {entityID}) "
+                               "AND EXISTS (SELECT 1 FROM Disks WHERE diskID = {diskID} AND freeSpace >= {size}) "
+                               "AND NOT EXISTS (SELECT 1 FROM QueryOnDisk WHERE queryID = {entityID} "
+                               "AND diskID = {diskID}) AS succeeds")
+        else:
+            sqlQuery = sql.SQL("SELECT EXISTS (SELECT 1 FROM RAMs WHERE ramID = {entityID}) "
+                               "AND EXISTS (SELECT 1 FROM Disks WHERE diskID = {diskID}) "
+                               "AND NOT EXISTS (SELECT 1 FROM RAMOnDisk WHERE ramID = {entityID} "
+                               "AND diskID = {diskID}) AS succeeds")
+        rows_affected, result = conn.execute(sqlQuery.format(entityID=sql.Literal(operation.entityID),
+                                                             diskID=sql.Literal(operation.diskID),
+                                                             size=sql.Literal(operation.size)))
+        return result[0]['succeeds']